@@ -0,0 +1,185 @@
+import redis
+from redis import asyncio as aioredis
+from cachetools import TTLCache
+from channels.db import database_sync_to_async
+
+from .models import RoomMember, StorageUsage
+
+redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+async_redis_client = aioredis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+
+ROOM_MEMBERS_TTL = 60 * 60
+# Other processes only see an invalidation once their local entry expires,
+# so a removed member can keep sending for at most this many seconds. The
+# Redis set itself is never refilled from a read that raced an invalidation:
+# invalidate_room_members bumps a generation the refill has to match.
+ROOM_MEMBERS_LOCAL_TTL = 5
+ROOM_MEMBERS_LOCAL_SIZE = 10_000
+
+_local_room_members = TTLCache(maxsize=ROOM_MEMBERS_LOCAL_SIZE, ttl=ROOM_MEMBERS_LOCAL_TTL)
+
+
+_REFILL_IF_GENERATION = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV, 5000 do
+    redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 4999, #ARGV)))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def _room_members_key(room_id):
+    return f"room_members:{room_id}"
+
+
+def _room_members_generation_key(room_id):
+    return f"room_members_gen:{room_id}"
+
+
+def _load_room_member_ids(room_id):
+    return frozenset(RoomMember.objects.filter(room_id=room_id).values_list("user_id", flat=True))
+
+
+async def get_room_member_ids(room_id):
+    """
+    Member ids of a room, served from the in-process LRU, then the Redis set,
+    and only on a double miss from the database.
+    """
+    room_id = str(room_id)
+    member_ids = _local_room_members.get(room_id)
+    if member_ids is not None:
+        return member_ids
+
+    key = _room_members_key(room_id)
+    generation_key = _room_members_generation_key(room_id)
+    pipeline = async_redis_client.pipeline()
+    pipeline.smembers(key)
+    pipeline.get(generation_key)
+    cached, generation = await pipeline.execute()
+    if cached:
+        member_ids = frozenset(int(member_id) for member_id in cached)
+    else:
+        member_ids = await database_sync_to_async(_load_room_member_ids)(room_id)
+        if member_ids:
+            # Skipped when an invalidation landed after the generation was read
+            await async_redis_client.eval(
+                _REFILL_IF_GENERATION, 2, key, generation_key,
+                generation or "", ROOM_MEMBERS_TTL, *member_ids
+            )
+
+    _local_room_members[room_id] = member_ids
+    return member_ids
+
+
+def invalidate_room_members(room_id):
+    _local_room_members.pop(str(room_id), None)
+    pipeline = redis_client.pipeline()
+    pipeline.incr(_room_members_generation_key(room_id))
+    pipeline.expire(_room_members_generation_key(room_id), ROOM_MEMBERS_TTL)
+    pipeline.delete(_room_members_key(room_id))
+    pipeline.execute()
+
+
+# Unread counters: one hash per user, field room_id -> unread messages.
+# Fields are only incremented once they exist; a missing field is computed
+# from the watermarks on first read, so the hash never under-counts.
+UNREAD_TTL = 7 * 24 * 60 * 60
+
+_INCREMENT_EXISTING = """
+for _, key in ipairs(KEYS) do
+    if redis.call('HEXISTS', key, ARGV[1]) == 1 then
+        redis.call('HINCRBY', key, ARGV[1], 1)
+    end
+end
+return 0
+"""
+
+
+def _unread_key(user_id):
+    return f"unread:{user_id}"
+
+
+async def increment_unread(room_id, member_ids, sender_id):
+    keys = [_unread_key(member_id) for member_id in member_ids if member_id != sender_id]
+    if keys:
+        await async_redis_client.eval(_INCREMENT_EXISTING, len(keys), *keys, str(room_id))
+
+
+async def set_unread(user_id, room_id, count):
+    key = _unread_key(user_id)
+    pipeline = async_redis_client.pipeline()
+    pipeline.hset(key, str(room_id), count)
+    pipeline.expire(key, UNREAD_TTL)
+    await pipeline.execute()
+
+
+def store_unread_counts(counts, replace=False):
+    """
+    Writes {user_id: {room_id: count}} into the per-user hashes. With
+    replace=True each user's hash is rebuilt from scratch.
+    """
+    pipeline = redis_client.pipeline()
+    for user_id, rooms in counts.items():
+        key = _unread_key(user_id)
+        if replace:
+            pipeline.delete(key)
+        if rooms:
+            pipeline.hset(key, mapping={str(room_id): count for room_id, count in rooms.items()})
+            pipeline.expire(key, UNREAD_TTL)
+    pipeline.execute()
+
+
+def get_unread_counts(user_id, room_ids):
+    """
+    Unread counts for a user's rooms in one HMGET; rooms without a counter yet
+    are computed from the database and written back.
+    """
+    room_ids = [str(room_id) for room_id in room_ids]
+    if not room_ids:
+        return {}
+    cached = redis_client.hmget(_unread_key(user_id), room_ids)
+    counts = {room_id: int(value) for room_id, value in zip(room_ids, cached) if value is not None}
+
+    missing = [room_id for room_id in room_ids if room_id not in counts]
+    if missing:
+        computed = {
+            str(room_id): count
+            for _, room_id, count in RoomMember.objects.unread_counts(user_id=user_id, room_id__in=missing)
+        }
+        counts.update(computed)
+        if computed:
+            store_unread_counts({user_id: computed})
+    return counts
+
+
+def scan_unread_user_ids(count=500):
+    for key in redis_client.scan_iter(match=_unread_key("*"), count=count):
+        yield int(key.split(":", 1)[1])
+
+
+# Read side of StorageUsage for the quota pre-check on upload. The database
+# row stays authoritative: StorageUsage.objects.reserve decides admission.
+STORAGE_USED_TTL = 5 * 60
+
+
+def _storage_used_key(user_id):
+    return f"storage_used:{user_id}"
+
+
+def get_storage_used(user_id):
+    cached = redis_client.get(_storage_used_key(user_id))
+    if cached is not None:
+        return int(cached)
+    used = StorageUsage.objects.filter(user_id=user_id).values_list("storage_used", flat=True).first() or 0
+    redis_client.set(_storage_used_key(user_id), used, ex=STORAGE_USED_TTL)
+    return used
+
+
+def invalidate_storage_used(user_ids):
+    keys = [_storage_used_key(user_id) for user_id in user_ids]
+    if keys:
+        redis_client.delete(*keys)
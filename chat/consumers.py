@@ -1,168 +1,205 @@
+import uuid
 import json
+import asyncio
+from collections import defaultdict
 import redis
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from redis import asyncio as aioredis
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from django.db.models import Prefetch, Q
 from django.utils import timezone
-from .models import ChatRoom, Message, File, MessageAction, MessageStatus
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from utils.pagination import decode_cursor, encode_cursor
+from .cache import get_room_member_ids, increment_unread, set_unread
+from .models import ChatRoom, Message, File, MessageAction, RoomMember
+from .tasks import MESSAGE_STREAM
 
 redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+async_redis_client = aioredis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
 HEARTBEAT_TTL = 60
+UNDELIVERED_BATCH_SIZE = 50
+# Batches pushed on join; past this the client pulls the rest with fetch_undelivered
+UNDELIVERED_MAX_BATCHES = 10
+# Write-behind sends stay replyable under pending_message:{id} until the writer persists them
+PENDING_MESSAGE_TTL = 10 * 60
+# Live frames are acknowledged as delivered in one write per room after this many seconds
+DELIVERY_ACK_DELAY = 1
 
 
-class MultiRoomChatConsumer(WebsocketConsumer):
-    def connect(self):
+class MultiRoomChatConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
         self.joined_rooms = set()
+        # room_id -> {message_id: created_at} of live frames not yet acknowledged
+        self.received = defaultdict(dict)
+        self.ack_task = None
         user = self.scope["user"]
         if not user.is_authenticated:
-            self.close()
+            await self.close()
             return
         self.user = user
 
-        redis_client.sadd(f"user_channels:{self.user.id}", self.channel_name)
-        redis_client.setex(f"channel:{self.channel_name}", HEARTBEAT_TTL, self.user.id)
+        pipeline = async_redis_client.pipeline()
+        pipeline.sadd(f"user_channels:{self.user.id}", self.channel_name)
+        pipeline.setex(f"channel:{self.channel_name}", HEARTBEAT_TTL, self.user.id)
+        await pipeline.execute()
 
-        self.accept()
-        self._set_online()
+        # Per-user group for in-band notifications
+        await self.channel_layer.group_add(f"user.{self.user.id}", self.channel_name)
+        await self.accept()
+        await self._set_online()
 
 
-    def disconnect(self, code):
+    async def disconnect(self, code):
         user = getattr(self, "user", None) or self.scope.get("user")
 
-        for rid in list(getattr(self, "joined_rooms", [])):
-            async_to_sync(self.channel_layer.group_discard)(
-                f"chat.{rid}", self.channel_name
-            )
+        if getattr(self, "ack_task", None):
+            self.ack_task.cancel()
+        if getattr(self, "received", None):
+            try:
+                await self._ack_deliveries(self.received)
+            except Exception:
+                pass
+
+        await asyncio.gather(*(
+            self.channel_layer.group_discard(f"chat.{rid}", self.channel_name)
+            for rid in list(getattr(self, "joined_rooms", []))
+        ))
 
         if user and user.is_authenticated:
-            redis_client.srem(f"user_channels:{user.id}", self.channel_name)
-            redis_client.delete(f"online_user:{user.id}")
+            await self.channel_layer.group_discard(f"user.{user.id}", self.channel_name)
+            pipeline = async_redis_client.pipeline()
+            pipeline.srem(f"user_channels:{user.id}", self.channel_name)
+            pipeline.delete(f"online_user:{user.id}")
+            await pipeline.execute()
 
             try:
-                user.last_online = timezone.now()
-                user.save(update_fields=["last_online"])
+                await self._update_last_online(user)
             except Exception:
                 pass
 
-        redis_client.delete(f"channel:{self.channel_name}")
+        await async_redis_client.delete(f"channel:{self.channel_name}")
 
     # --- helpers ---
-    def _set_online(self):
-        redis_client.setex(f"online_user:{self.user.id}", HEARTBEAT_TTL, "1")
-        redis_client.expire(f"channel:{self.channel_name}", HEARTBEAT_TTL)
-        redis_client.expire(f"user_channels:{self.user.id}", HEARTBEAT_TTL)
-
-    def _is_online(self, user_id):
-        return redis_client.get(f"online_user:{user_id}") == "1"
+    async def _set_online(self):
+        pipeline = async_redis_client.pipeline()
+        pipeline.setex(f"online_user:{self.user.id}", HEARTBEAT_TTL, "1")
+        pipeline.expire(f"channel:{self.channel_name}", HEARTBEAT_TTL)
+        pipeline.expire(f"user_channels:{self.user.id}", HEARTBEAT_TTL)
+        await pipeline.execute()
+
+    async def _is_online(self, user_id):
+        return await async_redis_client.get(f"online_user:{user_id}") == "1"
+
+    async def _resolve_reply_to(self, reply_to_id, room_id):
+        """Canonical id of a reply target in `room_id`, or None when it is not one."""
+        try:
+            reply_to_id = str(uuid.UUID(str(reply_to_id)))
+        except ValueError:
+            return None
+        # A write-behind send the writer has not persisted yet
+        if await async_redis_client.get(f"pending_message:{reply_to_id}") == room_id:
+            return reply_to_id
+        return await self._get_room_message_id(reply_to_id, room_id)
+
+    async def _send_error(self, event, message):
+        await self.send_json({"event": event, "type": "error", "message": message})
 
     # --- receive router ---
-    def receive(self, text_data=None):
-        data = json.loads(text_data)
-
-        t = data.get("type")
+    async def receive_json(self, content, **kwargs):
+        t = content.get("type")
         if t == "ping":
-            self._set_online()
-            self.send(text_data=json.dumps({"type": "pong"}))
+            await self._set_online()
+            await self.send_json({"type": "pong"})
             return
 
         if t == "join_rooms":
-            self._handle_join_rooms(data)
+            await self._handle_join_rooms(content)
             return
 
         if t == "message":
-            self._handle_message(data)
+            await self._handle_message(content)
             return
-        
+
         if t == "edit_message":
-            self._handle_edit_message(data)
+            await self._handle_edit_message(content)
             return
-        
+
         if t == "delete_message":
-            self._handle_delete_message(data)
+            await self._handle_delete_message(content)
             return
 
         if t == "read":
-            self._handle_read(data)
+            await self._handle_read(content)
+            return
+
+        if t == "read_up_to":
+            await self._handle_read_up_to(content)
+            return
+
+        if t == "mark_room_read":
+            await self._handle_mark_room_read(content)
+            return
+
+        if t == "fetch_undelivered":
+            await self._handle_fetch_undelivered(content)
             return
 
         if t == "action":
-            self._handle_action(data)
+            await self._handle_action(content)
             return
-        
+
         if t == "typing":
-            self._handle_typing(data)
+            await self._handle_typing(content)
             return
 
     # --- handlers ---
-    def _handle_join_rooms(self, data):
-        room_ids = data.get("rooms", [])
-        qs = ChatRoom.objects.filter(id__in=room_ids, members__id=self.user.id).values_list("id", flat=True)
-        for rid in qs:
-            async_to_sync(self.channel_layer.group_add)(f"chat.{rid}", self.channel_name)
-            self.joined_rooms.add(str(rid))
-        self.send(text_data=json.dumps({
+    async def _handle_join_rooms(self, data):
+        room_ids = await self._get_member_room_ids(data.get("rooms", []))
+        await asyncio.gather(*(
+            self.channel_layer.group_add(f"chat.{rid}", self.channel_name)
+            for rid in room_ids
+        ))
+        self.joined_rooms.update(room_ids)
+        await self.send_json({
             "action": "join_rooms",
             "status": "ok",
             "joined_rooms": list(self.joined_rooms),
-        }))
-        self._send_undelivered_messages()
+        })
+        await self._send_undelivered_messages()
 
-    def _handle_message(self, data):
+    async def _handle_message(self, data):
         room_id = str(data.get("room_id"))
         if room_id not in self.joined_rooms:
-            self.send(text_data=json.dumps({"event": "message", "type": "error", "message": "Not joined to the room"}))
+            await self._send_error("message", "Not joined to the room")
             return
-        room = ChatRoom.objects.filter(id=room_id, members__id=self.user.id).first()
-        if not room:
-            self.send(text_data=json.dumps({"event": "message", "type": "error", "message": "Not joined to the room"}))
-            return
-        text = data.get("text")
         reply_to_id = data.get("reply_to")
         file_id = data.get("file_id")
 
-        reply_to = Message.objects.filter(id=reply_to_id, room_id=room_id).first() if reply_to_id else None
-        
-        # Validate file ownership
-        file = None
-        if file_id:
-            file = File.objects.filter(id=file_id, owners=self.user).first()
-            if not file:
-                self.send(text_data=json.dumps({"event": "message", "type": "error", "message": "File not found or not owned by you"}))
-                return
+        member_ids = await get_room_member_ids(room_id)
+        if self.user.id not in member_ids:
+            await self._send_error("message", "Not joined to the room")
+            return
 
-        message = Message.objects.create(room=room, sender=self.user, text=text, reply_to=reply_to)
-        if file:
-            message.attachments.add(file)
-            if file.is_temporary:
-                file.is_temporary = False
-                file.save(update_fields=["is_temporary"])
+        if reply_to_id:
+            reply_to_id = await self._resolve_reply_to(reply_to_id, room_id)
+            if not reply_to_id:
+                await self._send_error("message", "Reply target not found in this room")
+                return
 
-        # Use Redis pipeline for efficient online status checking
-        member_ids = list(room.members.values_list("id", flat=True))
-        pipeline = redis_client.pipeline()
-        for member_id in member_ids:
-            pipeline.get(f"online_user:{member_id}")
-        results = pipeline.execute()
+        if settings.CHAT_WRITE_BEHIND:
+            await self._handle_message_write_behind(room_id, member_ids, data.get("text"), reply_to_id, file_id)
+            return
 
-        online_cache = {
-            member_id: (result == "1") 
-            for member_id, result in zip(member_ids, results)
-        }
+        message, error = await self._create_message(room_id, data.get("text"), reply_to_id, file_id)
+        if error:
+            await self._send_error("message", error)
+            return
+        await increment_unread(room_id, member_ids, self.user.id)
+        await self._advance_watermarks(message)
 
-        statuses = []
-        now = timezone.now()
-        for member_id in member_ids:
-            is_me = (member_id == self.user.id)
-            statuses.append(MessageStatus(
-                message=message,
-                user_id=member_id,
-                is_delivered=online_cache[member_id],
-                delivered_at=now if online_cache[member_id] else None,
-                is_read=is_me,
-                read_at=now if is_me else None
-            ))
-        MessageStatus.objects.bulk_create(statuses, batch_size=200)
-
-        async_to_sync(self.channel_layer.group_send)(
+        await self.channel_layer.group_send(
             f"chat.{room_id}",
             {
                 "type": "chat.message",
@@ -170,24 +207,61 @@ class MultiRoomChatConsumer(WebsocketConsumer):
                 "message_id": str(message.id),
                 "text": message.text,
                 "sender": self.user.username,
+                "sender_id": self.user.id,
                 "reply_to": str(reply_to_id),
                 "file_id": str(file_id),
                 "created_at": message.created_at.isoformat()
             }
         )
 
-    def _handle_edit_message(self, data):
-        message_id = data.get("message_id")
-        text = data.get("text")
-        message = Message.objects.select_related("room").filter(id=message_id, sender=self.user).first()
-        if not message or str(message.room_id) not in self.joined_rooms:
-            self.send(text_data=json.dumps({"event": "edit_message", "type": "error", "message": "Message not found or not authorized"}))
+    async def _handle_message_write_behind(self, room_id, member_ids, text, reply_to_id, file_id):
+        # Validate only what the sender controls; the stream writer persists the
+        # message (and resolves reply_to/delivery state) after the broadcast.
+        file_pk = None
+        if file_id:
+            file_pk = await self._get_owned_file_id(file_id)
+            if not file_pk:
+                await self._send_error("message", "File not found or not owned by you")
+                return
+
+        message_id = str(uuid.uuid4())
+        created_at = timezone.now().isoformat()
+        pipeline = async_redis_client.pipeline()
+        pipeline.xadd(MESSAGE_STREAM, {"data": json.dumps({
+            "id": message_id,
+            "room_id": room_id,
+            "sender_id": self.user.id,
+            "text": text,
+            "reply_to": reply_to_id,
+            "file_id": file_pk,
+            "created_at": created_at,
+        })})
+        pipeline.setex(f"pending_message:{message_id}", PENDING_MESSAGE_TTL, room_id)
+        await pipeline.execute()
+        await increment_unread(room_id, member_ids, self.user.id)
+
+        await self.channel_layer.group_send(
+            f"chat.{room_id}",
+            {
+                "type": "chat.message",
+                "room_id": room_id,
+                "message_id": message_id,
+                "text": text,
+                "sender": self.user.username,
+                "sender_id": self.user.id,
+                "reply_to": str(reply_to_id),
+                "file_id": str(file_id),
+                "created_at": created_at
+            }
+        )
+
+    async def _handle_edit_message(self, data):
+        message = await self._edit_message(data.get("message_id"), data.get("text"))
+        if not message:
+            await self._send_error("edit_message", "Message not found or not authorized")
             return
 
-        message.text = text
-        message.is_edited = True
-        message.save(update_fields=["text", "is_edited", "update_at"])
-        async_to_sync(self.channel_layer.group_send)(
+        await self.channel_layer.group_send(
             f"chat.{message.room_id}",
             {
                 "type": "chat.edit_message",
@@ -198,19 +272,14 @@ class MultiRoomChatConsumer(WebsocketConsumer):
             }
         )
 
-    def _handle_delete_message(self, data):
+    async def _handle_delete_message(self, data):
         message_id = data.get("message_id")
-        message = Message.objects.select_related("room").filter(
-            id=message_id
-        ).first()
-
-        if not message or str(message.room_id) not in self.joined_rooms:
-            self.send(text_data=json.dumps({"event": "delete_message", "type": "error", "message": "Message not found or not authorized"}))
+        room_id = await self._delete_message(message_id)
+        if not room_id:
+            await self._send_error("delete_message", "Message not found or not authorized")
             return
 
-        room_id = message.room_id
-        message.delete()
-        async_to_sync(self.channel_layer.group_send)(
+        await self.channel_layer.group_send(
             f"chat.{room_id}",
             {
                 "type": "chat.delete_message",
@@ -218,16 +287,14 @@ class MultiRoomChatConsumer(WebsocketConsumer):
             }
         )
 
-    def _handle_action(self, data):
-        message_id = data.get("message_id")
+    async def _handle_action(self, data):
         value = data.get("value")
-        message = Message.objects.select_related("room").filter(id=message_id).first()
-        if not message or str(message.room_id) not in self.joined_rooms:
-            self.send(text_data=json.dumps({"event": "action", "type": "error", "message": "Message not found or not authorized"}))
+        message, action = await self._set_action(data.get("message_id"), value)
+        if not message:
+            await self._send_error("action", "Message not found or not authorized")
             return
 
-        action, _ = MessageAction.objects.update_or_create(message=message, user=self.user, defaults={"value": value})
-        async_to_sync(self.channel_layer.group_send)(
+        await self.channel_layer.group_send(
             f"chat.{message.room_id}",
             {
                 "type": "chat.action",
@@ -238,48 +305,95 @@ class MultiRoomChatConsumer(WebsocketConsumer):
             }
         )
 
-    def _handle_read(self, data):
-        message_id = data.get("message_id")
-        message = Message.objects.select_related("room").filter(id=message_id).first()
-        if not message or str(message.room_id) not in self.joined_rooms:
-            self.send(text_data=json.dumps({"event": "read", "type": "error", "message": "Message not found or not authorized"}))
+    async def _handle_read(self, data):
+        message, read_at, unread = await self._mark_read(data.get("message_id"))
+        if not message:
+            await self._send_error("read", "Message not found or not authorized")
             return
 
-        status = MessageStatus.objects.filter(message=message, user=self.user).first()
-        if status and not status.is_read:
-            status.is_read = True
-            status.read_at = timezone.now()
-            status.save(update_fields=["is_read", "read_at"])
-            async_to_sync(self.channel_layer.group_send)(
+        if read_at:
+            await set_unread(self.user.id, message.room_id, unread)
+            await self.channel_layer.group_send(
                 f"chat.{message.room_id}",
                 {
                     "type": "chat.read",
                     "message_id": str(message.id),
                     "user": self.user.username,
-                    "read_at": status.read_at.isoformat()
+                    "read_at": read_at.isoformat()
                 }
             )
 
-    def _handle_typing(self, data):
+    async def _handle_read_up_to(self, data):
+        message, read_range, unread = await self._mark_read_up_to(data.get("message_id"))
+        if not message:
+            await self._send_error("read_up_to", "Message not found or not authorized")
+            return
+
+        if read_range:
+            from_message_id, read_count = read_range
+            await set_unread(self.user.id, message.room_id, unread)
+            await self.channel_layer.group_send(
+                f"chat.{message.room_id}",
+                {
+                    "type": "chat.read",
+                    "message_id": str(message.id),
+                    "from_message_id": str(from_message_id) if from_message_id else None,
+                    "read_count": read_count,
+                    "user": self.user.username,
+                    "read_at": timezone.now().isoformat()
+                }
+            )
+
+    async def _handle_mark_room_read(self, data):
+        room_id = str(data.get("room_id"))
+        if room_id not in self.joined_rooms:
+            await self._send_error("mark_room_read", "Not joined to the room")
+            return
+
+        message, read_at = await self._mark_room_read(room_id)
+        await set_unread(self.user.id, room_id, 0)
+        if read_at:
+            await self.channel_layer.group_send(
+                f"chat.{room_id}",
+                {
+                    "type": "chat.read",
+                    "message_id": str(message.id),
+                    "user": self.user.username,
+                    "read_at": read_at.isoformat()
+                }
+            )
+
+    async def _handle_fetch_undelivered(self, data):
+        cursor = data.get("cursor")
+        if cursor:
+            if not isinstance(cursor, str):
+                await self._send_error("fetch_undelivered", "Invalid cursor")
+                return
+            try:
+                cursor = decode_cursor(cursor, Message._meta.pk)
+            except NotFound:
+                await self._send_error("fetch_undelivered", "Invalid cursor")
+                return
+        await self._send_undelivered_messages(cursor)
+
+    async def _handle_typing(self, data):
         room_id = str(data.get("room_id"))
         is_typing = data.get("is_typing", False)
 
         if room_id not in self.joined_rooms:
-            self.send(text_data=json.dumps({"event": "typing", "type": "error", "message": "Not joined to the room"}))
+            await self._send_error("typing", "Not joined to the room")
             return
-        
+
         # Throttling - prevent spam (max once per 2 seconds)
         cache_key = f"typing:{self.user.id}:{room_id}"
-        if redis_client.exists(cache_key):
+        if not await async_redis_client.set(cache_key, "1", ex=2, nx=True):
             return  # Too fast, ignore
-        redis_client.setex(cache_key, 2, "1")  # 2 second throttle
-        
-        room = ChatRoom.objects.filter(id=room_id, members__id=self.user.id).first()
-        if not room:
-            self.send(text_data=json.dumps({"event": "typing", "type": "error", "message": "Not joined to the room"}))
+
+        if self.user.id not in await get_room_member_ids(room_id):
+            await self._send_error("typing", "Not joined to the room")
             return
-        
-        async_to_sync(self.channel_layer.group_send)(
+
+        await self.channel_layer.group_send(
             f"chat.{room_id}",
             {
                 "type": "chat.typing",
@@ -289,29 +403,25 @@ class MultiRoomChatConsumer(WebsocketConsumer):
         )
 
     # --- edit message event handlers ---
-    def chat_edit_message(self, event):
-        self.send(text_data=json.dumps(
-            {
-                "type": "edit_message",
-                "message_id": event["message_id"],
-                "text": event["text"],
-                "created_at": event["created_at"],
-                "updated_at": event["updated_at"]
-            }
-        ))
+    async def chat_edit_message(self, event):
+        await self.send_json({
+            "type": "edit_message",
+            "message_id": event["message_id"],
+            "text": event["text"],
+            "created_at": event["created_at"],
+            "updated_at": event["updated_at"]
+        })
 
     # --- delete message event handlers ---
-    def chat_delete_message(self, event):
-        self.send(text_data=json.dumps(
-            {
-                "type": "delete_message",
-                "message_id": event["message_id"]
-            }
-        ))
+    async def chat_delete_message(self, event):
+        await self.send_json({
+            "type": "delete_message",
+            "message_id": event["message_id"]
+        })
 
     # --- group event handlers ---
-    def chat_message(self, event):
-        self.send(text_data=json.dumps({
+    async def chat_message(self, event):
+        await self.send_json({
             "type": "message",
             "room_id": event["room_id"],
             "message_id": event["message_id"],
@@ -320,87 +430,281 @@ class MultiRoomChatConsumer(WebsocketConsumer):
             "reply_to": event["reply_to"],
             "file_id": event["file_id"],
             "created_at": event["created_at"]
-        }))
-
-    def chat_action(self, event):
-        self.send(text_data=json.dumps({
+        })
+        # Only frames this socket actually forwarded count as delivered
+        if event.get("sender_id") != self.user.id:
+            self.received[event["room_id"]][event["message_id"]] = parse_datetime(event["created_at"])
+            if self.ack_task is None:
+                self.ack_task = asyncio.create_task(self._ack_deliveries_later())
+
+    async def _ack_deliveries_later(self):
+        await asyncio.sleep(DELIVERY_ACK_DELAY)
+        received, self.received = self.received, defaultdict(dict)
+        self.ack_task = None
+        leftover = await self._ack_deliveries(received)
+        # Write-behind sends not persisted yet are retried with the next ack
+        for room_id, frames in leftover.items():
+            self.received[room_id].update(frames)
+
+    async def chat_action(self, event):
+        await self.send_json({
             "type": "action",
             "message_id": event["message_id"],
             "value": event["value"],
             "user": event["user"],
             "created_at": event["created_at"]
-        }))
+        })
 
-    def chat_read(self, event):
-        self.send(text_data=json.dumps({
+    async def chat_read(self, event):
+        payload = {
             "type": "read",
             "message_id": event["message_id"],
             "user": event["user"],
             "read_at": event["read_at"]
-        }))
-
-    def chat_typing(self, event):
-        self.send(text_data=json.dumps({
+        }
+        # Range reads from read_up_to: everything after from_message_id up to message_id
+        if "read_count" in event:
+            payload["from_message_id"] = event["from_message_id"]
+            payload["read_count"] = event["read_count"]
+        await self.send_json(payload)
+
+    async def notification_new(self, event):
+        await self.send_json({
+            "type": "notification",
+            "notification": event["notification"]
+        })
+
+    async def chat_typing(self, event):
+        await self.send_json({
             "type": "typing",
             "user": event["user"],
             "is_typing": event["is_typing"]
-        }))
+        })
 
-    def chat_cleared(self, event):
-        self.send(text_data=json.dumps({
+    async def chat_cleared(self, event):
+        await self.send_json({
             "type": "cleared",
             "room_id": event["room_id"],
             "cleared_by": event["cleared_by"]
-        }))
+        })
 
-    def chat_deleted(self, event):
+    async def chat_deleted(self, event):
         room_id = str(event["room_id"])
 
-        self.send(text_data=json.dumps(
-            {
-                "type": "chat_deleted",
-                "room_id": room_id,
-                "deleted_by": event["deleted_by"]
-            }
-        ))
-        if room_id in self.joined_rooms:
-            self.joined_rooms.remove(room_id)
+        await self.send_json({
+            "type": "chat_deleted",
+            "room_id": room_id,
+            "deleted_by": event["deleted_by"]
+        })
+        self.joined_rooms.discard(room_id)
 
-        async_to_sync(self.channel_layer.group_discard)(
+        await self.channel_layer.group_discard(
             f"chat.{room_id}",
             self.channel_name
         )
 
     # --- undelivered ---
-    def _send_undelivered_messages(self):
+    async def _send_undelivered_messages(self, cursor=None):
         if not self.joined_rooms:
-            self.send(text_data=json.dumps({"event": "undelivered_messages", "type": "error", "message": "Not joined to any room"}))
+            await self._send_error("undelivered_messages", "Not joined to any room")
             return
 
-        # Limit to 100 messages to prevent overwhelming the client
-        qs = (MessageStatus.objects
-              .filter(user=self.user, is_delivered=False, message__room_id__in=self.joined_rooms)
-              .select_related("message", "message__sender")
-              .order_by("message__created_at")[:100])
+        for _ in range(UNDELIVERED_MAX_BATCHES):
+            messages, cursor = await self._collect_undelivered_messages(cursor)
+            if not messages:
+                break
+            await self.send_json({
+                "type": "undelivered_messages",
+                "messages": messages,
+                "next_cursor": encode_cursor(*cursor) if cursor else None,
+            })
+            if not cursor:
+                break
+
+    # --- database access ---
+    # Each handler does its ORM work in a single thread hop so the event loop
+    # is never blocked and the threadpool is touched once per frame.
+    @database_sync_to_async
+    def _update_last_online(self, user):
+        user.last_online = timezone.now()
+        user.save(update_fields=["last_online"])
+
+    @database_sync_to_async
+    def _get_member_room_ids(self, room_ids):
+        qs = ChatRoom.objects.filter(id__in=room_ids, members__id=self.user.id).values_list("id", flat=True)
+        return [str(rid) for rid in qs]
+
+    @database_sync_to_async
+    def _get_room_message_id(self, message_id, room_id):
+        if Message.objects.filter(id=message_id, room_id=room_id).exists():
+            return message_id
+        return None
 
-        # Convert to list for bulk_update
-        statuses = list(qs)
-        now = timezone.now()
+    @database_sync_to_async
+    def _get_owned_file_id(self, file_id):
+        return File.objects.filter(id=file_id, owners=self.user).values_list("id", flat=True).first()
 
-        for st in statuses:
-            msg = st.message
-            self.send(text_data=json.dumps({
+    @database_sync_to_async
+    def _create_message(self, room_id, text, reply_to_id, file_id):
+        reply_to = Message.objects.filter(id=reply_to_id, room_id=room_id).first() if reply_to_id else None
+
+        # Validate file ownership
+        file = None
+        if file_id:
+            file = File.objects.filter(id=file_id, owners=self.user).first()
+            if not file:
+                return None, "File not found or not owned by you"
+
+        message = Message.objects.create(room_id=room_id, sender=self.user, text=text, reply_to=reply_to)
+        if file:
+            message.attachments.add(file)
+            if file.is_temporary:
+                file.is_temporary = False
+                file.save(update_fields=["is_temporary"])
+        return message, None
+
+    @database_sync_to_async
+    def _advance_watermarks(self, message):
+        RoomMember.objects.mark_read(message.room_id, self.user.id, message)
+
+    @database_sync_to_async
+    def _ack_deliveries(self, received):
+        leftover = {}
+        for room_id, frames in received.items():
+            pending = RoomMember.objects.mark_received(room_id, self.user.id, frames)
+            if pending:
+                leftover[room_id] = pending
+        return leftover
+
+    @database_sync_to_async
+    def _edit_message(self, message_id, text):
+        message = Message.objects.filter(id=message_id, sender=self.user).first()
+        if not message or str(message.room_id) not in self.joined_rooms:
+            return None
+
+        message.text = text
+        message.is_edited = True
+        message.save(update_fields=["text", "is_edited", "update_at"])
+        return message
+
+    @database_sync_to_async
+    def _delete_message(self, message_id):
+        message = Message.objects.filter(id=message_id).first()
+        if not message or str(message.room_id) not in self.joined_rooms:
+            return None
+
+        room_id = message.room_id
+        message.delete()
+        return room_id
+
+    @database_sync_to_async
+    def _set_action(self, message_id, value):
+        message = Message.objects.filter(id=message_id).first()
+        if not message or str(message.room_id) not in self.joined_rooms:
+            return None, None
+
+        action, _ = MessageAction.objects.update_or_create(message=message, user=self.user, defaults={"value": value})
+        return message, action
+
+    @database_sync_to_async
+    def _mark_read(self, message_id):
+        message = Message.objects.filter(id=message_id).first()
+        if not message or str(message.room_id) not in self.joined_rooms:
+            return None, None, None
+
+        if not RoomMember.objects.mark_read(message.room_id, self.user.id, message):
+            return message, None, None
+        unread = (
+            Message.objects
+            .filter(room_id=message.room_id, created_at__gt=message.created_at)
+            .exclude(sender=self.user)
+            .count()
+        )
+        return message, timezone.now(), unread
+
+    @database_sync_to_async
+    def _mark_read_up_to(self, message_id):
+        message = Message.objects.filter(id=message_id).first()
+        if not message or str(message.room_id) not in self.joined_rooms:
+            return None, None, None
+
+        read_range = RoomMember.objects.mark_read_up_to(message.room_id, self.user.id, message)
+        if not read_range:
+            return message, None, None
+        unread = (
+            Message.objects
+            .filter(room_id=message.room_id, created_at__gt=message.created_at)
+            .exclude(sender=self.user)
+            .count()
+        )
+        return message, read_range, unread
+
+    @database_sync_to_async
+    def _mark_room_read(self, room_id):
+        message = Message.objects.filter(room_id=room_id).order_by("-created_at").first()
+        if not message or not RoomMember.objects.mark_read(room_id, self.user.id, message):
+            return message, None
+        return message, timezone.now()
+
+    @database_sync_to_async
+    def _collect_undelivered_messages(self, cursor=None):
+        """
+        One batch of messages past each room's delivered watermark, oldest
+        first, with the watermarks advanced in bulk. Returns the payloads and
+        the (created_at, pk) to resume from, or None when nothing is left.
+        """
+        members = list(
+            RoomMember.objects
+            .filter(user=self.user, room_id__in=self.joined_rooms)
+            .only("id", "room_id", "joined_at", "last_delivered_at")
+        )
+        if not members:
+            return [], None
+
+        # With a cursor the watermark is inclusive and the keyset skips what was
+        # already sent, so messages sharing a timestamp are not lost.
+        lookup = "created_at__gte" if cursor else "created_at__gt"
+        pending = Q()
+        for member in members:
+            pending |= Q(room_id=member.room_id, **{lookup: member.last_delivered_at or member.joined_at})
+
+        qs = Message.objects.filter(pending).exclude(sender=self.user)
+        if cursor:
+            created_at, pk = cursor
+            qs = qs.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+        batch = list(
+            qs
+            .prefetch_related(Prefetch("attachments", queryset=File.objects.only("id")))
+            .order_by("created_at", "pk")[:UNDELIVERED_BATCH_SIZE + 1]
+        )
+        has_more = len(batch) > UNDELIVERED_BATCH_SIZE
+        batch = batch[:UNDELIVERED_BATCH_SIZE]
+
+        payloads = []
+        delivered_up_to = {}
+        for msg in batch:
+            attachments = msg.attachments.all()
+            payloads.append({
                 "type": "message",
                 "room_id": str(msg.room_id),
                 "message_id": str(msg.id),
                 "text": msg.text,
-                "sender": msg.sender.id,
+                "sender": msg.sender_id,
                 "reply_to": str(msg.reply_to_id) if msg.reply_to_id else None,
-                "file_id": getattr(getattr(msg, "file", None), "id", None),
+                "file_id": str(attachments[0].id) if attachments else None,
                 "created_at": msg.created_at.isoformat()
-            }))
-            st.is_delivered = True
-            st.delivered_at = now
-
-        if statuses:
-            MessageStatus.objects.bulk_update(statuses, ["is_delivered", "delivered_at"], batch_size=200)
+            })
+            delivered_up_to[msg.room_id] = msg.created_at
+
+        advanced = []
+        for member in members:
+            if member.room_id in delivered_up_to:
+                member.last_delivered_at = delivered_up_to[member.room_id]
+                advanced.append(member)
+        if advanced:
+            RoomMember.objects.bulk_update(advanced, ["last_delivered_at"], batch_size=200)
+
+        if not has_more:
+            return payloads, None
+        last = batch[-1]
+        return payloads, (last.created_at, last.pk)
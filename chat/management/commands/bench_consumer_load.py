@@ -0,0 +1,161 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import WebsocketConsumer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.urls import re_path
+
+from accounts.models import CustomUser
+from chat.cache import invalidate_room_members
+from chat.consumers import HEARTBEAT_TTL, redis_client
+from chat.models import ChatRoom, Message, RoomMember
+from chat.routing import websocket_urlpatterns
+
+
+class SyncChatConsumer(WebsocketConsumer):
+    """
+    The pre-rewrite consumer's connect, join_rooms and message paths: blocking
+    Redis and ORM calls on the socket's worker thread, group calls through
+    async_to_sync. Per-message status rows are gone from the schema, so the
+    message path stops at the online lookup the old one did before writing them.
+    """
+
+    def connect(self):
+        self.user = self.scope["user"]
+        self.joined_rooms = set()
+        redis_client.sadd(f"user_channels:{self.user.id}", self.channel_name)
+        redis_client.setex(f"channel:{self.channel_name}", HEARTBEAT_TTL, self.user.id)
+        self.accept()
+        redis_client.setex(f"online_user:{self.user.id}", HEARTBEAT_TTL, "1")
+
+    def disconnect(self, code):
+        for room_id in self.joined_rooms:
+            async_to_sync(self.channel_layer.group_discard)(f"chat.{room_id}", self.channel_name)
+        redis_client.srem(f"user_channels:{self.user.id}", self.channel_name)
+        redis_client.delete(f"online_user:{self.user.id}", f"channel:{self.channel_name}")
+
+    def receive(self, text_data=None):
+        data = json.loads(text_data)
+        if data.get("type") == "join_rooms":
+            rooms = ChatRoom.objects.filter(id__in=data.get("rooms", []), members__id=self.user.id)
+            for room_id in rooms.values_list("id", flat=True):
+                async_to_sync(self.channel_layer.group_add)(f"chat.{room_id}", self.channel_name)
+                self.joined_rooms.add(str(room_id))
+            self.send(text_data=json.dumps({"action": "join_rooms", "status": "ok", "joined_rooms": list(self.joined_rooms)}))
+        elif data.get("type") == "message":
+            room = ChatRoom.objects.filter(id=data.get("room_id"), members__id=self.user.id).first()
+            message = Message.objects.create(room=room, sender=self.user, text=data.get("text"))
+            pipeline = redis_client.pipeline()
+            for member_id in room.members.values_list("id", flat=True):
+                pipeline.get(f"online_user:{member_id}")
+            pipeline.execute()
+            async_to_sync(self.channel_layer.group_send)(f"chat.{room.id}", {
+                "type": "chat.message",
+                "room_id": str(room.id),
+                "message_id": str(message.id),
+                "text": message.text,
+                "created_at": message.created_at.isoformat(),
+            })
+
+    def chat_message(self, event):
+        self.send(text_data=json.dumps({"type": "message", **{k: v for k, v in event.items() if k != "type"}}))
+
+
+class Command(BaseCommand):
+    help = (
+        "Opens N in-process sockets on the sync baseline consumer and on MultiRoomChatConsumer, joins them "
+        "to one group and times connect/join and message fan-out (configured channel layer and Redis; "
+        "seeded rows are deleted)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=500)
+        parser.add_argument("--messages", type=int, default=20)
+        parser.add_argument("--timeout", type=float, default=30)
+
+    def handle(self, *args, **options):
+        # The consumer talks to the DB from its own worker threads, so the seed
+        # is committed and removed afterwards instead of rolled back
+        room, users = self._seed(options["sockets"])
+        applications = [
+            ("sync", URLRouter([re_path(r"ws/chat/$", SyncChatConsumer.as_asgi())])),
+            ("async", URLRouter(websocket_urlpatterns)),
+        ]
+        try:
+            results = [
+                (label, asyncio.run(self._run(application, room, users, options["messages"], options["timeout"])))
+                for label, application in applications
+            ]
+        finally:
+            invalidate_room_members(room.id)
+            room.delete()
+            CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        self.stdout.write(f"{options['sockets']} sockets in one group, {options['messages']} messages")
+        for label, (connect, fan_out, threads) in results:
+            self.stdout.write(
+                f"{label:<6} connect + join p50 {connect[0]:9.2f} ms  p99 {connect[1]:9.2f} ms"
+                f"  |  fan-out p50 {fan_out[0]:9.2f} ms  p99 {fan_out[1]:9.2f} ms"
+                f"  |  threads {threads[0]} idle, {threads[1]} peak"
+            )
+
+    def _seed(self, count, batch_size=5000):
+        suffix = uuid.uuid4().hex[:8]
+        users = []
+        for offset in range(0, count, batch_size):
+            users += CustomUser.objects.bulk_create([
+                CustomUser(email=f"ws-{i}-{suffix}@example.com", username=f"ws_{i}_{suffix}")
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+        room = ChatRoom.objects.create(room_type=ChatRoom.GROUP, name=f"bench {suffix}")
+        RoomMember.objects.bulk_create([RoomMember(room=room, user=user) for user in users], batch_size=batch_size)
+        return room, users
+
+    async def _run(self, application, room, users, messages, timeout):
+        idle_threads = threading.active_count()
+
+        async def open_socket(user):
+            started = time.perf_counter()
+            communicator = WebsocketCommunicator(application, "/ws/chat/")
+            communicator.scope["user"] = user
+            connected, _ = await communicator.connect(timeout=timeout)
+            if not connected:
+                raise RuntimeError(f"socket for user {user.pk} was refused")
+            await communicator.send_json_to({"type": "join_rooms", "rooms": [str(room.id)]})
+            while "joined_rooms" not in await communicator.receive_json_from(timeout=timeout):
+                pass
+            return communicator, (time.perf_counter() - started) * 1000
+
+        opened = await asyncio.gather(*(open_socket(user) for user in users))
+        sockets = [communicator for communicator, _ in opened]
+        peak_threads = threading.active_count()
+
+        async def wait_for(communicator, text):
+            while True:
+                frame = await communicator.receive_json_from(timeout=timeout)
+                if frame.get("type") == "message" and frame.get("text") == text:
+                    return
+
+        fan_out = []
+        try:
+            for i in range(messages):
+                text = f"bench {i}"
+                started = time.perf_counter()
+                await sockets[0].send_json_to({"type": "message", "room_id": str(room.id), "text": text})
+                await asyncio.gather(*(wait_for(communicator, text) for communicator in sockets))
+                fan_out.append((time.perf_counter() - started) * 1000)
+                peak_threads = max(peak_threads, threading.active_count())
+        finally:
+            await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+
+        return self._percentiles([elapsed for _, elapsed in opened]), self._percentiles(fan_out), (idle_threads, peak_threads)
+
+    def _percentiles(self, samples):
+        samples = sorted(samples)
+        return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
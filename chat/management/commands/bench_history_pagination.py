@@ -0,0 +1,86 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from accounts.models import CustomUser
+from chat.models import ChatRoom, Message, RoomMember
+from chat.pagination import MessageCursorPagination
+from utils.pagination import encode_cursor
+
+
+class Command(BaseCommand):
+    help = "p50/p99 of room history pages at increasing depth: LIMIT/OFFSET with COUNT vs keyset cursor (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument("--pages", type=int, nargs="+", default=[1, 50, 500])
+        parser.add_argument("--runs", type=int, default=30)
+
+    def handle(self, *args, **options):
+        runs = options["runs"]
+        size = MessageCursorPagination.page_size
+        factory = APIRequestFactory()
+        with transaction.atomic():
+            room = self._seed(options["messages"])
+            queryset = Message.objects.filter(room=room)
+
+            def offset_page(page):
+                request = Request(factory.get("/", {"limit": size, "offset": (page - 1) * size}))
+                return LimitOffsetPagination().paginate_queryset(queryset.order_by("-created_at"), request)
+
+            def keyset_page(cursor):
+                request = Request(factory.get("/", {"before": cursor} if cursor else {}))
+                return MessageCursorPagination().paginate_queryset(queryset, request)
+
+            results = []
+            for page in options["pages"]:
+                # The cursor a client holds after scrolling to this page
+                anchor = (
+                    queryset.order_by("-created_at", "-pk").values_list("created_at", "pk")[(page - 1) * size - 1]
+                    if page > 1 else None
+                )
+                cursor = encode_cursor(*anchor) if anchor else None
+                results.append((
+                    page,
+                    self._time(runs, lambda: offset_page(page)),
+                    self._time(runs, lambda: keyset_page(cursor)),
+                ))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{options['messages']} messages in one room, {size} per page")
+        for page, (offset_p50, offset_p99), (keyset_p50, keyset_p99) in results:
+            self.stdout.write(
+                f"page {page:>5}  offset p50 {offset_p50:9.2f} ms  p99 {offset_p99:9.2f} ms"
+                f"  |  keyset p50 {keyset_p50:9.2f} ms  p99 {keyset_p99:9.2f} ms"
+            )
+
+    def _seed(self, count, batch_size=10000):
+        suffix = uuid.uuid4().hex[:8]
+        sender = CustomUser.objects.create_user(email=f"history-{suffix}@example.com", username=f"history_{suffix}")
+        room = ChatRoom.objects.create(room_type=ChatRoom.GROUP, name=f"bench {suffix}")
+        RoomMember.objects.create(room=room, user=sender)
+
+        start = timezone.now() - timedelta(seconds=count)
+        for offset in range(0, count, batch_size):
+            Message.objects.bulk_create([
+                Message(room=room, sender=sender, text=str(i), created_at=start + timedelta(seconds=i))
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+        return room
+
+    def _time(self, runs, fn):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
@@ -0,0 +1,111 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from accounts.models import CustomUser
+from chat.models import ChatRoom, Message, MessageAction, RoomMember
+from chat.serializers import MessageHistorySerializer, MessageSerializer
+from chat.views import MessageViewSet
+
+REACTIONS = ["like", "love", "laugh", "wow", "sad"]
+
+
+class Command(BaseCommand):
+    help = "Serialization time and payload size of one history page: full receipt trees vs the compact serializer (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, default=300)
+        parser.add_argument("--messages", type=int, default=100)
+        parser.add_argument("--reactions", type=int, default=20, help="Reactions per message")
+        parser.add_argument("--runs", type=int, default=10)
+
+    def handle(self, *args, **options):
+        runs = options["runs"]
+        with transaction.atomic():
+            room, reader = self._seed(options["members"], options["messages"], options["reactions"])
+            request = Request(APIRequestFactory().get("/"))
+            request.user = reader
+            view = MessageViewSet(request=request, format_kwarg=None, action="list")
+
+            def full_page():
+                page = list(
+                    Message.objects.filter(room=room)
+                    .prefetch_related("attachments", "attachments__variants", "actions")
+                    .order_by("-created_at")
+                )
+                data = MessageSerializer(page, many=True, context={"request": request}).data
+                # The per-member receipt list every message used to carry
+                members = list(RoomMember.objects.filter(room=room).values_list("user_id", "last_delivered_at", "last_read_at"))
+                for message, item in zip(page, data):
+                    item["statuses"] = [
+                        {
+                            "user": user_id,
+                            "is_delivered": bool(delivered_at and delivered_at >= message.created_at),
+                            "is_read": bool(read_at and read_at >= message.created_at),
+                        }
+                        for user_id, delivered_at, read_at in members if user_id != message.sender_id
+                    ]
+                return JSONRenderer().render(data)
+
+            def compact_page():
+                page = list(
+                    Message.objects.filter(room=room)
+                    .prefetch_related("attachments", "attachments__variants")
+                    .order_by("-created_at")
+                )
+                context = {**view.get_serializer_context(), **view.get_history_context(page)}
+                return JSONRenderer().render(MessageHistorySerializer(page, many=True, context=context).data)
+
+            results = [("full", self._measure(runs, full_page)), ("compact", self._measure(runs, compact_page))]
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"{options['messages']} messages, {options['members']} members, {options['reactions']} reactions each"
+        )
+        for label, (queries, p50, size) in results:
+            self.stdout.write(f"{label:<8} {queries:>4} queries  p50 {p50:9.2f} ms  {size / 1024:9.1f} KiB")
+
+    def _seed(self, members, count, reactions):
+        suffix = uuid.uuid4().hex[:8]
+        users = CustomUser.objects.bulk_create([
+            CustomUser(email=f"hist-{i}-{suffix}@example.com", username=f"hist_{i}_{suffix}")
+            for i in range(members)
+        ])
+        room = ChatRoom.objects.create(room_type=ChatRoom.GROUP, name=f"bench {suffix}")
+        RoomMember.objects.bulk_create([RoomMember(room=room, user=user) for user in users])
+
+        start = timezone.now() - timedelta(seconds=count)
+        messages = Message.objects.bulk_create([
+            Message(room=room, sender=users[i % members], text=f"message {i}", created_at=start + timedelta(seconds=i))
+            for i in range(count)
+        ])
+        # Half the room has read up to the middle of the page, everyone got all of it
+        RoomMember.objects.filter(room=room).update(last_delivered_at=messages[-1].created_at)
+        RoomMember.objects.filter(room=room, user__in=users[:members // 2]).update(
+            last_read_message=messages[count // 2], last_read_at=messages[count // 2].created_at
+        )
+        MessageAction.objects.bulk_create([
+            MessageAction(message=message, user=users[(i + j) % members], value=REACTIONS[j % len(REACTIONS)])
+            for i, message in enumerate(messages)
+            for j in range(min(reactions, members))
+        ])
+        return room, users[0]
+
+    def _measure(self, runs, fn):
+        samples = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(runs):
+                started = time.perf_counter()
+                payload = fn()
+                samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        return len(queries) // runs, samples[len(samples) // 2], len(payload)
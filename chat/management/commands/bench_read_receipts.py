@@ -0,0 +1,69 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from chat.models import ChatRoom, Message, RoomMember
+
+
+class Command(BaseCommand):
+    help = "Compares per-message `read` receipts with a single `read_up_to` on throwaway data (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200)
+
+    def handle(self, *args, **options):
+        count = options["messages"]
+        with transaction.atomic():
+            room, reader, message_ids = self._seed(count)
+
+            per_message = self._measure(lambda: self._read_each(room, reader, message_ids))
+            RoomMember.objects.filter(room=room, user=reader).update(
+                last_read_message=None, last_read_at=None, last_delivered_at=None
+            )
+            up_to = self._measure(lambda: self._read_up_to(room, reader, message_ids[-1]))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{count} unread messages")
+        self.stdout.write(f"read x{count}:  {per_message[0]:>5} queries  {per_message[1]:8.1f} ms  {count} broadcasts")
+        self.stdout.write(f"read_up_to:   {up_to[0]:>5} queries  {up_to[1]:8.1f} ms  1 broadcast")
+
+    def _seed(self, count):
+        suffix = uuid.uuid4().hex[:8]
+        sender = CustomUser.objects.create_user(email=f"bench-s-{suffix}@example.com", username=f"bench_s_{suffix}")
+        reader = CustomUser.objects.create_user(email=f"bench-r-{suffix}@example.com", username=f"bench_r_{suffix}")
+        room = ChatRoom.objects.create(room_type="private")
+        RoomMember.objects.bulk_create([RoomMember(room=room, user=sender), RoomMember(room=room, user=reader)])
+
+        start = timezone.now() - timedelta(seconds=count)
+        messages = Message.objects.bulk_create([
+            Message(room=room, sender=sender, text=str(i), created_at=start + timedelta(seconds=i))
+            for i in range(count)
+        ])
+        return room, reader, [message.id for message in messages]
+
+    def _measure(self, fn):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            fn()
+            elapsed = (time.perf_counter() - started) * 1000
+        return len(queries), elapsed
+
+    def _read_each(self, room, reader, message_ids):
+        # Mirrors ChatConsumer._mark_read, one frame per message
+        for message_id in message_ids:
+            message = Message.objects.filter(id=message_id).first()
+            if RoomMember.objects.mark_read(room.id, reader.id, message):
+                Message.objects.filter(room_id=room.id, created_at__gt=message.created_at).exclude(sender=reader).count()
+
+    def _read_up_to(self, room, reader, message_id):
+        # Mirrors ChatConsumer._mark_read_up_to
+        message = Message.objects.filter(id=message_id).first()
+        if RoomMember.objects.mark_read_up_to(room.id, reader.id, message):
+            Message.objects.filter(room_id=room.id, created_at__gt=message.created_at).exclude(sender=reader).count()
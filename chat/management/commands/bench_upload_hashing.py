@@ -0,0 +1,53 @@
+import hashlib
+import os
+import time
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.management.base import BaseCommand
+
+from chat.upload_handlers import HashingTemporaryFileUploadHandler
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Command(BaseCommand):
+    help = "Streams a synthetic upload through the stock and the hashing upload handlers and compares end-to-end time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=int, default=500)
+
+    def handle(self, *args, **options):
+        size = options["size_mb"] * 1024 * 1024
+        block = os.urandom(CHUNK_SIZE)
+
+        old_seconds, old_hash = self._run(TemporaryFileUploadHandler, block, size, rehash=True)
+        new_seconds, new_hash = self._run(HashingTemporaryFileUploadHandler, block, size, rehash=False)
+        assert old_hash == new_hash
+
+        mb = options["size_mb"]
+        self.stdout.write(f"{mb} MB upload")
+        self.stdout.write(f"spool + second hashing pass: {old_seconds:7.2f} s  ({mb / old_seconds:7.1f} MB/s)")
+        self.stdout.write(f"hash while streaming:        {new_seconds:7.2f} s  ({mb / new_seconds:7.1f} MB/s)")
+
+    def _run(self, handler_class, block, size, rehash):
+        handler = handler_class()
+        started = time.perf_counter()
+        handler.new_file("file", "bench.bin", "application/octet-stream", size)
+        for start in range(0, size, CHUNK_SIZE):
+            handler.receive_data_chunk(block, start)
+        uploaded_file = handler.file_complete(size)
+
+        if rehash:
+            # What FileManager did before: reread the spooled file to hash it
+            hasher = hashlib.sha256()
+            uploaded_file.open("rb")
+            for chunk in uploaded_file.chunks():
+                hasher.update(chunk)
+            uploaded_file.seek(0)
+            digest = hasher.hexdigest()
+        else:
+            digest = uploaded_file.sha256
+
+        elapsed = time.perf_counter() - started
+        uploaded_file.close()
+        return elapsed, digest
@@ -0,0 +1,97 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from chat.models import ChatRoom, Message, RoomMember
+
+
+class Command(BaseCommand):
+    help = "Storage and query cost of per-member read/delivery watermarks on a large group room (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument("--members", type=int, default=500)
+        parser.add_argument("--runs", type=int, default=30)
+
+    def handle(self, *args, **options):
+        runs = options["runs"]
+        with transaction.atomic():
+            room, reader, messages = self._seed(options["messages"], options["members"])
+            # Half the history read, so counts and receipts work over a deep tail
+            middle, recent = messages[len(messages) // 2], messages[-50:]
+
+            def reset():
+                RoomMember.objects.filter(room=room, user=reader).update(
+                    last_read_message=middle[0], last_read_at=middle[1], last_delivered_at=middle[1]
+                )
+
+            def unread_counts():
+                return list(RoomMember.objects.unread_counts(user_id=reader.id, room_id=room.id))
+
+            last = Message.objects.get(pk=messages[-1][0])
+
+            def before_receive():
+                RoomMember.objects.filter(room=room, user=reader).update(last_delivered_at=messages[-51][1])
+
+            reset()
+            results = [
+                ("unread count", self._time(runs, unread_counts)),
+                ("read_up_to", self._time(runs, lambda: RoomMember.objects.mark_read_up_to(room.id, reader.id, last), reset)),
+                ("ack 50 received", self._time(
+                    runs, lambda: RoomMember.objects.mark_received(room.id, reader.id, dict(recent)), before_receive
+                )),
+            ]
+            watermark_rows = RoomMember.objects.filter(room=room).count()
+
+            transaction.set_rollback(True)
+
+        count, members = options["messages"], options["members"]
+        self.stdout.write(f"{count} messages in a {members}-member group")
+        self.stdout.write(f"receipt rows: {watermark_rows} watermarks vs {count * members} per-message statuses")
+        for label, (queries, p50, p99) in results:
+            self.stdout.write(f"{label:<16} {queries:>3} queries  p50 {p50:9.2f} ms  p99 {p99:9.2f} ms")
+
+    def _seed(self, count, members, batch_size=10000):
+        suffix = uuid.uuid4().hex[:8]
+        users = CustomUser.objects.bulk_create([
+            CustomUser(email=f"wm-{i}-{suffix}@example.com", username=f"wm_{i}_{suffix}")
+            for i in range(members)
+        ])
+        room = ChatRoom.objects.create(room_type=ChatRoom.GROUP, name=f"bench {suffix}")
+        start = timezone.now() - timedelta(seconds=count)
+        RoomMember.objects.bulk_create([RoomMember(room=room, user=user) for user in users])
+        RoomMember.objects.filter(room=room).update(joined_at=start - timedelta(seconds=1))
+
+        # The reader is users[0]; everyone else takes turns sending
+        senders = users[1:] or users
+        messages = []
+        for offset in range(0, count, batch_size):
+            created = Message.objects.bulk_create([
+                Message(room=room, sender=senders[i % len(senders)], text=str(i), created_at=start + timedelta(seconds=i))
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+            messages += [(str(message.id), message.created_at) for message in created]
+        return room, users[0], messages
+
+    def _time(self, runs, fn, setup=None):
+        samples, query_count = [], 0
+        for _ in range(runs):
+            if setup:
+                setup()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - started) * 1000)
+            query_count += len(queries)
+        samples.sort()
+        return (
+            query_count // runs,
+            samples[len(samples) // 2],
+            samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        )
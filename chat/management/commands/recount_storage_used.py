@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from chat.cache import invalidate_storage_used
+from chat.models import File, StorageUsage, recount_storage_used
+
+
+class Command(BaseCommand):
+    help = "Recomputes each user's chat storage_used from the File owner links."
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_ids", nargs="*", type=int, help="Only these users (default: all)")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # Owners whose counter row was never created still need one
+        owners = File.owners.through.objects.values_list("customuser_id", flat=True).distinct()
+        if options["user_ids"]:
+            owners = owners.filter(customuser_id__in=options["user_ids"])
+        StorageUsage.objects.bulk_create(
+            [StorageUsage(user_id=user_id) for user_id in owners], batch_size=1000, ignore_conflicts=True
+        )
+
+        queryset = StorageUsage.objects.order_by("pk")
+        if options["user_ids"]:
+            queryset = queryset.filter(pk__in=options["user_ids"])
+
+        batch_size = options["batch_size"]
+        updated, last_pk = 0, None
+        while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            pks = list(batch.values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            updated += recount_storage_used(StorageUsage.objects.filter(pk__in=pks))
+            invalidate_storage_used(pks)
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Recounted storage for {updated} users"))
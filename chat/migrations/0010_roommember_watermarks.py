@@ -0,0 +1,70 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Q, Subquery
+
+
+def backfill_watermarks(apps, schema_editor):
+    RoomMember = apps.get_model('chat', 'RoomMember')
+    MessageStatus = apps.get_model('chat', 'MessageStatus')
+
+    def member_statuses(ref):
+        # One membership's statuses, leaving out the member's own messages
+        return (
+            MessageStatus.objects
+            .filter(user=ref('user'), message__room=ref('room'))
+            .exclude(message__sender=ref('user'))
+        )
+
+    def outer_member(name):
+        return OuterRef(OuterRef(name))
+
+    def watermark(done):
+        """
+        The member's newest `done` status older than their oldest status that
+        is not done, so an earlier gap (e.g. the backlog the old replay left
+        undelivered) stays behind the watermark. Without a gap, the newest.
+        """
+        pending = member_statuses(outer_member).exclude(done)
+        first_gap = pending.order_by('message__created_at').values('message__created_at')[:1]
+        return (
+            member_statuses(OuterRef)
+            .filter(done)
+            .filter(Q(message__created_at__lt=Subquery(first_gap)) | ~Exists(pending))
+            .order_by('-message__created_at')
+        )
+
+    last_read = watermark(Q(is_read=True))
+    last_delivered = watermark(Q(is_delivered=True) | Q(is_read=True))
+    RoomMember.objects.update(
+        last_read_message=Subquery(last_read.values('message')[:1]),
+        last_read_at=Subquery(last_read.values('message__created_at')[:1]),
+        last_delivered_at=Subquery(last_delivered.values('message__created_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_alter_message_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roommember',
+            name='last_delivered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roommember',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roommember',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
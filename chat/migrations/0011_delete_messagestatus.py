@@ -0,0 +1,16 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:52
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_roommember_watermarks'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='MessageStatus',
+        ),
+    ]
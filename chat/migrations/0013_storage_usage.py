@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_storage_used(apps, schema_editor):
+    File = apps.get_model('chat', 'File')
+    StorageUsage = apps.get_model('chat', 'StorageUsage')
+    usage = (
+        File.owners.through.objects.order_by().values('customuser_id')
+        .annotate(total=Sum('file__file_size')).values_list('customuser_id', 'total')
+    )
+    StorageUsage.objects.bulk_create(
+        [StorageUsage(user_id=user_id, storage_used=total or 0) for user_id, total in usage], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_alter_customuser_options_and_more'),
+        ('chat', '0012_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('storage_used', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_storage_used, migrations.RunPython.noop),
+    ]
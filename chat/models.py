@@ -1,7 +1,12 @@
+import os
 import uuid
 import hashlib
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
+from django.contrib.contenttypes.fields import GenericRelation
+from django.utils import timezone
 from rest_framework.validators import ValidationError
 
 
@@ -42,6 +47,97 @@ class ChatRoom(models.Model):
         return f"{self.room_type}: {self.name or self.id}"
 
 
+class RoomMemberManager(models.Manager):
+    # Watermarks only ever move forward, so every update is guarded by a
+    # comparison against the stored mark.
+    def mark_received(self, room_id, user_id, received):
+        """
+        Advances the delivered watermark through messages the user got live
+        (`received`: {message_id: created_at}), stopping before the first
+        message in the room they did not get. Returns the received entries
+        still past the watermark, e.g. write-behind sends not persisted yet.
+        """
+        member = self.filter(room_id=room_id, user_id=user_id).values("last_delivered_at", "joined_at").first()
+        if not member:
+            return {}
+        mark = member["last_delivered_at"] or member["joined_at"]
+        rows = (
+            Message.objects
+            .filter(room_id=room_id, created_at__gt=mark)
+            .exclude(sender_id=user_id)
+            .order_by("created_at", "pk")
+            .values_list("id", "created_at")[:len(received) + 1]
+        )
+        covered = []
+        for message_id, created_at in rows:
+            if str(message_id) not in received:
+                # A missed message sharing the timestamp must stay past the mark
+                covered = [ts for ts in covered if ts < created_at]
+                break
+            covered.append(created_at)
+
+        if covered:
+            mark = covered[-1]
+            (
+                self.filter(room_id=room_id, user_id=user_id)
+                .filter(Q(last_delivered_at__isnull=True) | Q(last_delivered_at__lt=mark))
+                .update(last_delivered_at=mark)
+            )
+        return {message_id: created_at for message_id, created_at in received.items() if created_at > mark}
+
+    def mark_read(self, room_id, user_id, message):
+        created_at = message.created_at
+        return (
+            self.filter(room_id=room_id, user_id=user_id)
+            .filter(Q(last_read_at__isnull=True) | Q(last_read_at__lt=created_at))
+            .update(
+                last_read_message=message,
+                last_read_at=created_at,
+                last_delivered_at=Greatest(Coalesce("last_delivered_at", Value(created_at)), Value(created_at)),
+            )
+        )
+
+    def mark_read_up_to(self, room_id, user_id, message):
+        """
+        Moves the read watermark to `message` with a single UPDATE. Returns the
+        previous watermark message id and how many messages became read, or
+        None when the watermark was already at or past `message`.
+        """
+        previous = self.filter(room_id=room_id, user_id=user_id).values("last_read_message_id", "last_read_at").first()
+        if not previous or not self.mark_read(room_id, user_id, message):
+            return None
+
+        newly_read = (
+            Message.objects
+            .filter(room_id=room_id, created_at__lte=message.created_at)
+            .exclude(sender_id=user_id)
+        )
+        if previous["last_read_at"]:
+            newly_read = newly_read.filter(created_at__gt=previous["last_read_at"])
+        return previous["last_read_message_id"], newly_read.count()
+
+    def unread_counts(self, **filters):
+        """
+        Unread messages per membership, counted from the read watermark (or
+        joined_at for members that never read). Returns (user_id, room_id, count).
+        """
+        unread = (
+            Message.objects
+            .filter(room=OuterRef("room"), created_at__gt=OuterRef("read_mark"))
+            .exclude(sender=OuterRef("user"))
+            .order_by()
+            .values("room")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return (
+            self.filter(**filters)
+            .annotate(read_mark=Coalesce("last_read_at", "joined_at"))
+            .annotate(unread_count=Coalesce(Subquery(unread), 0))
+            .values_list("user_id", "room_id", "unread_count")
+        )
+
+
 class RoomMember(models.Model):
     MEMBER = "member"
     ADMIN = "admin"
@@ -57,6 +153,14 @@ class RoomMember(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     role = models.CharField(max_length=10, choices=ROLES, default=MEMBER)
     joined_at = models.DateTimeField(auto_now_add=True)
+    # Watermarks: every message in the room created up to these points is
+    # delivered to / read by this member. last_read_at mirrors
+    # last_read_message.created_at so deleting that message keeps the mark.
+    last_delivered_at = models.DateTimeField(null=True, blank=True)
+    last_read_message = models.ForeignKey("Message", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    objects = RoomMemberManager()
 
     class Meta:
         unique_together = ("room", "user")
@@ -72,7 +176,8 @@ class Message(models.Model):
     text = models.TextField(blank=True, null=True)
     reply_to = models.ForeignKey("self", on_delete=models.SET_NULL, null=True, blank=True, related_name="replies")
     is_edited = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: write-behind sends stamp the message before it is persisted
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     update_at = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -92,29 +197,58 @@ class Message(models.Model):
 
 
 # File model with custom manager
-class FileManager(models.Manager):
-    def get_or_create_with_owner(self, uploaded_file, owner, file_type="other"):
-        hasher = hashlib.sha256()
-        uploaded_file.open("rb")
-        for chunk in uploaded_file.chunks():
-            hasher.update(chunk)
-        file_hash = hasher.hexdigest()
-        uploaded_file.seek(0)
-
-        file, created = self.get_or_create(
-            unique_id=file_hash,
-            defaults={
-                "file": uploaded_file,
-                "file_type": file_type,
-                "file_size": uploaded_file.size,
-            },
-        )
+MAX_STORAGE = 200 * 1024 * 1024
+STORAGE_LIMIT_MESSAGE = "Storage limit reached! Delete old files to upload new ones."
 
-        already_owned = file.owners.filter(id=owner.id).exists()
-        if not already_owned:
-            file.owners.add(owner)
 
-        return file, created
+class FileManager(models.Manager):
+    def get_or_create_with_owner(self, uploaded_file, owner, file_type="other"):
+        # Set by chat.upload_handlers while the request streamed in
+        file_hash = getattr(uploaded_file, "sha256", None)
+        if file_hash is None:
+            hasher = hashlib.sha256()
+            uploaded_file.open("rb")
+            for chunk in uploaded_file.chunks():
+                hasher.update(chunk)
+            file_hash = hasher.hexdigest()
+            uploaded_file.seek(0)
+
+        # The quota reservation row stays locked until commit, so parallel
+        # uploads by one user are checked one after another
+        with transaction.atomic():
+            # A known hash never writes to storage; only the owner link is added
+            file = self.filter(unique_id=file_hash).first()
+            if file is None:
+                # Charged before the write so an upload over quota never reaches storage
+                self._charge(owner, uploaded_file.size)
+                file, created = self.get_or_create(
+                    unique_id=file_hash,
+                    defaults={
+                        "file": uploaded_file,
+                        "file_type": file_type,
+                        "file_size": uploaded_file.size,
+                    },
+                )
+                if created:
+                    file.owners.add(owner)
+                    return file, True
+                # Lost a race against the same content; charged again below if needed
+                StorageUsage.objects.release(owner.id, uploaded_file.size)
+
+            # Re-uploading an unattached file restarts its temporary-file TTL
+            if file.is_temporary:
+                self.filter(pk=file.pk).update(uploaded_at=timezone.now())
+
+            already_owned = file.owners.filter(id=owner.id).exists()
+            if not already_owned:
+                self._charge(owner, file.file_size)
+                file.owners.add(owner)
+
+        return file, False
+
+    def _charge(self, owner, size):
+        if not StorageUsage.objects.reserve(owner.id, size):
+            raise ValidationError(STORAGE_LIMIT_MESSAGE)
 
 
 # File model
@@ -135,6 +269,7 @@ class File(models.Model):
     file_size = models.BigIntegerField(editable=False, default=0)
     is_temporary = models.BooleanField(default=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    variants = GenericRelation("previews.MediaVariant")
 
     objects = FileManager()
 
@@ -147,6 +282,68 @@ class File(models.Model):
         return f"{self.file_type} - {self.unique_id[:10]}"
 
 
+class StorageUsageManager(models.Manager):
+    def reserve(self, user_id, size):
+        """
+        Adds `size` bytes to the user's counter with one conditional UPDATE,
+        unless that would pass MAX_STORAGE. Returns whether it fit.
+        """
+        for _ in range(2):
+            reserved = (
+                self.filter(user_id=user_id, storage_used__lte=MAX_STORAGE - size)
+                .update(storage_used=F("storage_used") + size)
+            )
+            if reserved:
+                return True
+            _, created = self.get_or_create(user_id=user_id)
+            if not created:
+                return False
+        return False
+
+    def release(self, user_id, size):
+        return self.filter(user_id=user_id).update(storage_used=Greatest(F("storage_used") - size, 0))
+
+
+# Bytes of chat files a user owns, charged once per owner link
+class StorageUsage(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name="storage_usage")
+    storage_used = models.BigIntegerField(default=0)
+
+    objects = StorageUsageManager()
+
+    def __str__(self):
+        return f"{self.user_id} - {self.storage_used}"
+
+
+def recount_storage_used(queryset=None):
+    """Recomputes storage_used from the File owner links."""
+    owned = (
+        File.owners.through.objects.filter(customuser_id=OuterRef('user_id'))
+        .order_by().values('customuser_id').annotate(s=Sum('file__file_size')).values('s')
+    )
+    queryset = StorageUsage.objects.all() if queryset is None else queryset
+    return queryset.update(storage_used=Coalesce(Subquery(owned), 0))
+
+
+# Resumable upload: chunks are appended to a part file until offset reaches total_size
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="upload_sessions")
+    filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=20, choices=File.FILE_TYPES, default="other")
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.CHAT_UPLOAD_SESSION_DIR, f"{self.id}.part")
+
+    def __str__(self):
+        return f"{self.filename} - {self.offset}/{self.total_size}"
+
+
 class MessageAction(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name="actions")
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -159,23 +356,3 @@ class MessageAction(models.Model):
 
     def __str__(self):
         return f"{self.user} {self.value} on {self.message.id}"
-
-
-class MessageStatus(models.Model):
-    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name="statuses")
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    is_delivered = models.BooleanField(default=False)
-    delivered_at = models.DateTimeField(null=True, blank=True)
-    is_read = models.BooleanField(default=False)
-    read_at = models.DateTimeField(null=True, blank=True)
-
-    class Meta:
-        unique_together = ("message", "user")
-        indexes = [
-            models.Index(fields=['user', 'is_delivered']),
-            models.Index(fields=['user', 'is_read']),
-        ]
-
-    def __str__(self):
-        return f"{self.user} - {self.message.id} (Read: {self.is_read})"
-
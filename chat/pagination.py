@@ -1,10 +1,7 @@
-from rest_framework.pagination import LimitOffsetPagination
+from utils.pagination import KeysetPagination
 
 
-class CustomLimitOffsetPagination(LimitOffsetPagination):
-    default_limit = 100
-    max_limit = 100
-
-    def paginate_queryset(self, queryset, request, view=None):
-        queryset = queryset.order_by('-created_at')
-        return super().paginate_queryset(queryset, request, view)
+class MessageCursorPagination(KeysetPagination):
+    # Pages walk the (room, -created_at) index; see utils.pagination.KeysetPagination
+    page_size = 100
+    max_page_size = 100
@@ -1,8 +1,11 @@
+from bisect import bisect_left
 from rest_framework import serializers
 
 from accounts.models import CustomUser
-from .models import ChatRoom, RoomMember, Message, File, MessageStatus, MessageAction
-from .validators import validate_user_storage
+from previews.serializers import MediaVariantsField
+from .models import ChatRoom, RoomMember, Message, File, MessageAction, UploadSession
+from .uploads import session_expiry
+from .validators import validate_storage_size, validate_user_storage
 
 
 # MessageAction serializer
@@ -15,19 +18,10 @@ class MessageActionSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-# MessageStatus serializer
-class MessageStatusSerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(queryset=CustomUser.objects.all())
-    message = serializers.PrimaryKeyRelatedField(queryset=Message.objects.all())
-
-    class Meta:
-        model = MessageStatus
-        fields = "__all__"
-
-
 # File serializer
 class FileSerializer(serializers.ModelSerializer):
     owners = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    variants = MediaVariantsField()
 
     class Meta:
         model = File
@@ -54,12 +48,31 @@ class FileSerializer(serializers.ModelSerializer):
         return file
 
 
+# Resumable upload session serializer
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ["id", "filename", "file_type", "total_size", "offset", "created_at", "expires_at"]
+        read_only_fields = ["offset", "created_at", "expires_at"]
+
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("total_size must be positive.")
+        # Checked up front so a client never sends 200 MB only to fail at finalize
+        validate_storage_size(self.context["request"].user, value)
+        return value
+
+    def create(self, validated_data):
+        validated_data["owner"] = self.context["request"].user
+        validated_data["expires_at"] = session_expiry()
+        return super().create(validated_data)
+
+
 # Message serializer
 class MessageSerializer(serializers.ModelSerializer):
     sender = serializers.PrimaryKeyRelatedField(queryset=CustomUser.objects.all())
     attachments = FileSerializer(many=True, read_only=True)
     reply_to = serializers.PrimaryKeyRelatedField(queryset=Message.objects.all(), required=False, allow_null=True)
-    statuses = MessageStatusSerializer(many=True, read_only=True)
     actions = MessageActionSerializer(many=True, read_only=True)
 
     class Meta:
@@ -73,6 +86,62 @@ class MessageSerializer(serializers.ModelSerializer):
         return attrs
 
 
+# Attachment as listed on history pages: no owners or messages relations,
+# which would cost a query per file and grow with every message sharing it
+class MessageAttachmentSerializer(serializers.ModelSerializer):
+    variants = MediaVariantsField()
+
+    class Meta:
+        model = File
+        fields = ["id", "file", "file_type", "file_size", "variants"]
+        read_only_fields = fields
+
+
+# Compact message serializer for history pages. Aggregates come from the
+# view's serializer context (see MessageViewSet.get_history_context) so a
+# page costs a fixed number of queries regardless of room size.
+class MessageHistorySerializer(serializers.ModelSerializer):
+    attachments = MessageAttachmentSerializer(many=True, read_only=True)
+    delivered_count = serializers.SerializerMethodField()
+    read_count = serializers.SerializerMethodField()
+    reactions = serializers.SerializerMethodField()
+    my_status = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = [
+            "id", "room", "sender", "text", "reply_to", "is_edited", "created_at", "update_at",
+            "attachments", "delivered_count", "read_count", "reactions", "my_status"
+        ]
+        read_only_fields = fields
+
+    def _count_reached(self, obj, marks_key, index):
+        # Members (other than the sender) whose watermark is at or past the message
+        marks = self.context[marks_key].get(obj.room_id, [])
+        count = len(marks) - bisect_left(marks, obj.created_at)
+        sender_marks = self.context["member_marks"].get((obj.room_id, obj.sender_id))
+        if sender_marks and sender_marks[index] and sender_marks[index] >= obj.created_at:
+            count -= 1
+        return count
+
+    def get_delivered_count(self, obj):
+        return self._count_reached(obj, "delivered_marks", 1)
+
+    def get_read_count(self, obj):
+        return self._count_reached(obj, "read_marks", 0)
+
+    def get_reactions(self, obj):
+        return self.context["reactions"].get(obj.id, {})
+
+    def get_my_status(self, obj):
+        read_at, delivered_at = self.context["member_marks"].get((obj.room_id, self.context["request"].user.id), (None, None))
+        return {
+            "is_delivered": bool(delivered_at and delivered_at >= obj.created_at),
+            "is_read": bool(read_at and read_at >= obj.created_at),
+            "reaction": self.context["my_reactions"].get(obj.id),
+        }
+
+
 # RoomMember serializer
 class RoomMemberSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(queryset=CustomUser.objects.all())
@@ -81,8 +150,8 @@ class RoomMemberSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RoomMember
-        fields = ["id", "room", "user", "role", "joined_at"]
-        read_only_fields = ["id", "role", "joined_at"]
+        fields = ["id", "room", "user", "role", "joined_at", "last_delivered_at", "last_read_message", "last_read_at"]
+        read_only_fields = ["id", "role", "joined_at", "last_delivered_at", "last_read_message", "last_read_at"]
 
     def validate(self, attrs):
         room = attrs.get("room")
@@ -1,25 +1,32 @@
-import os
-import redis
-from django.db.models.signals import post_delete, pre_save, post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_save, post_save
 from django.dispatch import receiver
-from django.utils import timezone
-from .models import File, Message, MessageStatus
-from notifications.utils import send_fcm_notification
-from notifications.constants import MESSAGE_TITLE, MESSAGE_BODY
+from .cache import invalidate_room_members, invalidate_storage_used
+from .models import File, Message, RoomMember
+from .tasks import collected_file_deletes, delete_stored_files
+from notifications.tasks import notify_message_recipients
+
+def delete_from_storage(name):
+    # Storage is touched after commit by a worker, never on the request path
+    collected = collected_file_deletes.get()
+    if collected is not None:
+        collected.append(name)
+    else:
+        transaction.on_commit(lambda: delete_stored_files.delay([name]))
 
-redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
 
 @receiver(post_delete, sender=File)
 def delete_file_from_disk(sender, instance, **kwargs):
     if instance.file:
-        if os.path.isfile(instance.file.path):
-            os.remove(instance.file.path)
+        delete_from_storage(instance.file.name)
 
 
 @receiver(pre_save, sender=File)
-def delete_old_file_on_update(sender, instance, **kwargs):
+def delete_old_file_on_update(sender, instance, update_fields=None, **kwargs):
     if not instance.pk:
         return False
+    if update_fields is not None and "file" not in update_fields:
+        return False
 
     try:
         old_file = File.objects.get(pk=instance.pk).file
@@ -28,34 +35,31 @@ def delete_old_file_on_update(sender, instance, **kwargs):
 
     new_file = instance.file
     if not old_file == new_file:
-        if old_file and os.path.isfile(old_file.path):
-            os.remove(old_file.path)
+        if old_file:
+            delete_from_storage(old_file.name)
+
+
+@receiver(m2m_changed, sender=File.owners.through)
+def invalidate_storage_on_owner_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove"):
+        return
+    user_ids = [instance.pk] if reverse else list(pk_set or ())
+    transaction.on_commit(lambda: invalidate_storage_used(user_ids))
+
+
+@receiver(post_save, sender=RoomMember)
+def invalidate_members_on_join(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: invalidate_room_members(instance.room_id))
+
+
+@receiver(post_delete, sender=RoomMember)
+def invalidate_members_on_leave(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_room_members(instance.room_id))
 
 
 @receiver(post_save, sender=Message)
 def notify_new_message(sender, instance, created, **kwargs):
     if created:
-        room = instance.room
-        sender_user = instance.sender
-        
-        # Get all members except sender
-        recipients = room.members.exclude(id=sender_user.id)
-        
-        for recipient in recipients:
-            # Check if user is online in Redis
-            is_online = redis_client.get(f"online_user:{recipient.id}") == "1"
-            
-            if not is_online:
-                title = MESSAGE_TITLE
-                body = MESSAGE_BODY.format(
-                    user=sender_user.username or sender_user.email,
-                    text=instance.text[:50] + "..." if instance.text and len(instance.text) > 50 else instance.text or "Fayl yuborildi"
-                )
-                send_fcm_notification(
-                    user=recipient,
-                    title=title,
-                    body=body,
-                    notification_type='message',
-                    sender=sender_user,
-                    data={'room_id': str(room.id), 'message_id': str(instance.id)}
-                )
+        message_id = str(instance.id)
+        transaction.on_commit(lambda: notify_message_recipients.delay(message_id))
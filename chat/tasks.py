@@ -0,0 +1,373 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+from contextvars import ContextVar
+from datetime import timedelta
+
+import redis
+from celery import shared_task
+from celery.signals import worker_ready
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models import Exists, OuterRef, Sum
+from django.db.models.signals import post_save
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from previews.tasks import collected_variant_deletes, delete_variant_files
+from .cache import invalidate_storage_used, scan_unread_user_ids, store_unread_counts
+from .models import File, Message, RoomMember, StorageUsage, UploadSession
+from .uploads import discard_part
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+
+# Write-behind message pipeline: the consumer XADDs every send here and the
+# writer drains it into Message and the member watermarks. A single stream keeps the
+# per-room send order intact.
+MESSAGE_STREAM = "chat:message_stream"
+MESSAGE_STREAM_GROUP = "message_writers"
+# Entries that cannot be persisted (malformed payload, constraint violation)
+# are parked here with the error instead of blocking the stream
+MESSAGE_DEAD_LETTER_STREAM = "chat:message_stream:dead"
+MESSAGE_STREAM_BATCH = 500
+MESSAGE_STREAM_MAX_BATCHES = 20
+# Entries unacked for this long belong to a writer that died mid-batch
+MESSAGE_STREAM_CLAIM_IDLE_MS = 30_000
+UNREAD_RECONCILE_CHUNK = 500
+TEMP_FILE_SWEEP_BATCH = 500
+TEMP_FILE_SWEEP_MAX_BATCHES = 20
+TEMP_FILE_SWEEP_STATS = "chat:temp_file_sweeper"
+
+# While set, the File post_delete signal appends storage names here instead
+# of queueing one cleanup task per row; batch deletes remove them together
+collected_file_deletes = ContextVar("collected_file_deletes", default=None)
+
+
+def _consumer_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _ensure_stream_group():
+    try:
+        redis_client.xgroup_create(MESSAGE_STREAM, MESSAGE_STREAM_GROUP, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _decode_entry(fields):
+    """Parses one stream entry; raises ValueError/KeyError/TypeError on a malformed payload."""
+    p = json.loads(fields["data"])
+    p["id"] = str(uuid.UUID(p["id"]))
+    p["room_id"] = str(uuid.UUID(p["room_id"]))
+    p["sender_id"] = int(p["sender_id"])
+    p["reply_to"] = str(uuid.UUID(p["reply_to"])) if p.get("reply_to") else None
+    p["file_id"] = int(p["file_id"]) if p.get("file_id") is not None else None
+    if parse_datetime(p["created_at"]) is None:
+        raise ValueError(f"Bad created_at {p['created_at']!r}")
+    return p
+
+
+def _persist_stream_entries(payloads):
+    """
+    Writes a batch of decoded stream payloads with multi-row inserts. Every
+    insert ignores conflicts so a replayed batch is a no-op for rows already
+    written. Returns the messages this call actually inserted.
+    """
+    message_ids = {p["id"] for p in payloads}
+    reply_ids = {p["reply_to"] for p in payloads if p["reply_to"]}
+    valid_replies = {
+        (str(mid), str(rid))
+        for mid, rid in Message.objects.filter(id__in=reply_ids).values_list("id", "room_id")
+    }
+    valid_replies.update((p["id"], p["room_id"]) for p in payloads)
+    file_ids = set(File.objects.filter(id__in={p["file_id"] for p in payloads if p["file_id"]}).values_list("id", flat=True))
+
+    messages, attachments = [], []
+    # The sender's watermarks only need their newest message per room. Recipients
+    # acknowledge delivery from their own consumer (RoomMember.objects.mark_received).
+    latest_by_sender = {}
+    for p in payloads:
+        created_at = parse_datetime(p["created_at"])
+        reply_to = p["reply_to"] if p["reply_to"] and (p["reply_to"], p["room_id"]) in valid_replies else None
+        messages.append(Message(
+            id=p["id"],
+            room_id=p["room_id"],
+            sender_id=p["sender_id"],
+            text=p["text"],
+            reply_to_id=reply_to,
+            created_at=created_at,
+        ))
+        if p["file_id"] in file_ids:
+            attachments.append(File.messages.through(file_id=p["file_id"], message_id=p["id"]))
+        latest_by_sender[(p["room_id"], p["sender_id"])] = messages[-1]
+
+    with transaction.atomic():
+        # Rows a crashed writer already committed are replays: no second notification
+        already_written = {str(pk) for pk in Message.objects.filter(id__in=message_ids).values_list("id", flat=True)}
+        Message.objects.bulk_create(messages, batch_size=200, ignore_conflicts=True)
+        File.messages.through.objects.bulk_create(attachments, batch_size=200, ignore_conflicts=True)
+        File.objects.filter(id__in={a.file_id for a in attachments}, is_temporary=True).update(is_temporary=False)
+        for (room_id, sender_id), message in latest_by_sender.items():
+            RoomMember.objects.mark_read(room_id, sender_id, message)
+
+    # bulk_create skips signals; fire post_save so notifications still go out
+    inserted_ids = message_ids - already_written
+    inserted = Message.objects.filter(id__in=inserted_ids).select_related("room", "sender").in_bulk()
+    inserted = {str(pk): instance for pk, instance in inserted.items()}
+    created = []
+    for message in messages:
+        instance = inserted.get(str(message.pk))
+        if instance:
+            post_save.send(sender=Message, instance=instance, created=True, update_fields=None, raw=False, using="default")
+            created.append(instance)
+    return created
+
+
+def _persist_one_by_one(decoded, dead):
+    """
+    Fallback after a failed batch: writes entries alone so one bad payload
+    does not hold back the rest. Data errors go to `dead`; a database outage
+    propagates and leaves the whole batch pending for the next reclaim.
+    """
+    for entry_id, payload in decoded:
+        try:
+            _persist_stream_entries([payload])
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as e:
+            dead.append((entry_id, json.dumps(payload), repr(e)))
+
+
+def _reject_non_members(decoded, dead):
+    """
+    Moves sends whose room was deleted or whose sender left before the flush
+    to `dead`; they were already broadcast, so they must leave a trace.
+    Returns the entries that can be written.
+    """
+    memberships = set(
+        RoomMember.objects
+        .filter(room_id__in={payload["room_id"] for _, payload in decoded})
+        .values_list("room_id", "user_id")
+    )
+    writable = []
+    for entry_id, payload in decoded:
+        if (uuid.UUID(payload["room_id"]), payload["sender_id"]) in memberships:
+            writable.append((entry_id, payload))
+        else:
+            logger.warning(
+                f"Dropping chat message {payload['id']}: sender {payload['sender_id']} "
+                f"is not a member of room {payload['room_id']}"
+            )
+            dead.append((entry_id, json.dumps(payload), "sender is not a member of the room"))
+    return writable
+
+
+def _dead_letter(dead):
+    pipeline = redis_client.pipeline()
+    for entry_id, data, error in dead:
+        pipeline.xadd(MESSAGE_DEAD_LETTER_STREAM, {"entry_id": entry_id, "data": data, "error": error})
+    pipeline.execute()
+    logger.error(f"Moved {len(dead)} unpersistable chat messages to {MESSAGE_DEAD_LETTER_STREAM}")
+
+
+def _flush_entries(entries):
+    if not entries:
+        return 0
+    decoded, dead = [], []
+    for entry_id, fields in entries:
+        try:
+            decoded.append((entry_id, _decode_entry(fields)))
+        except (KeyError, TypeError, ValueError) as e:
+            dead.append((entry_id, fields.get("data", ""), repr(e)))
+
+    if decoded:
+        decoded = _reject_non_members(decoded, dead)
+    if decoded:
+        try:
+            _persist_stream_entries([payload for _, payload in decoded])
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception:
+            logger.exception("Chat message batch failed; persisting entries one by one")
+            _persist_one_by_one(decoded, dead)
+    if dead:
+        _dead_letter(dead)
+
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pipeline = redis_client.pipeline()
+    pipeline.xack(MESSAGE_STREAM, MESSAGE_STREAM_GROUP, *entry_ids)
+    pipeline.xdel(MESSAGE_STREAM, *entry_ids)
+    pipeline.execute()
+    return len(entries)
+
+
+def _reclaim_stale_entries(consumer):
+    """
+    Claims entries a writer read but never acknowledged (it crashed or hit an
+    outage mid-batch) and persists them in stream order.
+    """
+    reclaimed = 0
+    cursor = "0-0"
+    while True:
+        result = redis_client.xautoclaim(
+            MESSAGE_STREAM, MESSAGE_STREAM_GROUP, consumer,
+            min_idle_time=MESSAGE_STREAM_CLAIM_IDLE_MS, start_id=cursor, count=MESSAGE_STREAM_BATCH
+        )
+        cursor, entries = result[0], result[1]
+        # Entries deleted from the stream but still pending come back with no fields
+        gone = [entry_id for entry_id, fields in entries if not fields]
+        if gone:
+            redis_client.xack(MESSAGE_STREAM, MESSAGE_STREAM_GROUP, *gone)
+        reclaimed += _flush_entries([entry for entry in entries if entry[1]])
+        if cursor == "0-0":
+            break
+    return reclaimed
+
+
+@shared_task
+def flush_message_stream():
+    _ensure_stream_group()
+    consumer = _consumer_name()
+    flushed = _reclaim_stale_entries(consumer)
+    for _ in range(MESSAGE_STREAM_MAX_BATCHES):
+        response = redis_client.xreadgroup(
+            MESSAGE_STREAM_GROUP, consumer, {MESSAGE_STREAM: ">"}, count=MESSAGE_STREAM_BATCH
+        )
+        entries = response[0][1] if response else []
+        if not entries:
+            break
+        flushed += _flush_entries(entries)
+    return flushed
+
+
+@shared_task
+def replay_pending_messages():
+    _ensure_stream_group()
+    replayed = _reclaim_stale_entries(_consumer_name())
+    if replayed:
+        logger.info(f"Replayed {replayed} pending chat messages from {MESSAGE_STREAM}")
+    return replayed
+
+
+@worker_ready.connect
+def replay_on_worker_start(sender, **kwargs):
+    replay_pending_messages.delay()
+
+
+@shared_task
+def reconcile_unread_counters():
+    """
+    Rebuilds the Redis unread hashes from the database watermarks, fixing
+    drift from deleted messages or counters lost between compute and write.
+    """
+    user_ids = list(scan_unread_user_ids())
+    for i in range(0, len(user_ids), UNREAD_RECONCILE_CHUNK):
+        chunk = user_ids[i:i + UNREAD_RECONCILE_CHUNK]
+        counts = {user_id: {} for user_id in chunk}
+        for user_id, room_id, count in RoomMember.objects.unread_counts(user_id__in=chunk):
+            counts[user_id][room_id] = count
+        store_unread_counts(counts, replace=True)
+    return len(user_ids)
+
+
+@shared_task
+def expire_upload_sessions():
+    """
+    Drops resumable upload sessions nobody touched within the TTL, then any
+    part file left without a session (a crash between delete and unlink).
+    """
+    expired = list(UploadSession.objects.filter(expires_at__lt=timezone.now()).values_list("id", flat=True))
+    UploadSession.objects.filter(id__in=expired).delete()
+    for session_id in expired:
+        discard_part(session_id)
+
+    orphans = 0
+    if os.path.isdir(settings.CHAT_UPLOAD_SESSION_DIR):
+        cutoff = time.time() - settings.CHAT_UPLOAD_SESSION_TTL
+        stale = set()
+        for entry in os.scandir(settings.CHAT_UPLOAD_SESSION_DIR):
+            if entry.name.endswith(".part") and entry.stat().st_mtime < cutoff:
+                try:
+                    stale.add(uuid.UUID(entry.name[:-len(".part")]))
+                except ValueError:
+                    continue
+        live = set(UploadSession.objects.filter(id__in=stale).values_list("id", flat=True))
+        for session_id in stale - live:
+            discard_part(session_id)
+            orphans += 1
+
+    if expired or orphans:
+        logger.info(f"Expired {len(expired)} upload sessions, removed {orphans} orphaned part files")
+    return len(expired)
+
+
+@shared_task
+def delete_stored_files(names):
+    storage = File._meta.get_field("file").storage
+    for name in names:
+        storage.delete(name)
+    return len(names)
+
+
+@shared_task
+def sweep_temporary_files(max_batches=TEMP_FILE_SWEEP_MAX_BATCHES):
+    """
+    Deletes temporary uploads that were never attached to a message within
+    CHAT_TEMP_FILE_TTL, oldest first in batches on the (is_temporary,
+    uploaded_at) index. Owners get the bytes back on their storage counter.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.CHAT_TEMP_FILE_TTL)
+    attached = File.messages.through.objects.filter(file_id=OuterRef("pk"))
+    owner_links = File.owners.through.objects
+
+    swept_files = swept_bytes = 0
+    for _ in range(max_batches):
+        names, variant_names = [], []
+        token = collected_file_deletes.set(names)
+        variant_token = collected_variant_deletes.set(variant_names)
+        try:
+            with transaction.atomic():
+                # Locked rows cannot gain a message link until this batch commits
+                batch = list(
+                    File.objects.select_for_update(skip_locked=True)
+                    .filter(is_temporary=True, uploaded_at__lt=cutoff)
+                    .filter(~Exists(attached))
+                    .order_by("uploaded_at")
+                    .values_list("id", "file_size")[:TEMP_FILE_SWEEP_BATCH]
+                )
+                if not batch:
+                    break
+                file_ids = [file_id for file_id, _ in batch]
+                released = list(
+                    owner_links.filter(file_id__in=file_ids).order_by().values("customuser_id")
+                    .annotate(total=Sum("file__file_size")).values_list("customuser_id", "total")
+                )
+                for user_id, total in released:
+                    StorageUsage.objects.release(user_id, total or 0)
+                File.objects.filter(id__in=file_ids).delete()
+        finally:
+            collected_variant_deletes.reset(variant_token)
+            collected_file_deletes.reset(token)
+
+        delete_stored_files(names)
+        delete_variant_files(variant_names)
+        invalidate_storage_used([user_id for user_id, _ in released])
+        swept_files += len(batch)
+        swept_bytes += sum(size for _, size in batch)
+        if len(batch) < TEMP_FILE_SWEEP_BATCH:
+            break
+
+    if swept_files:
+        pipeline = redis_client.pipeline()
+        pipeline.hincrby(TEMP_FILE_SWEEP_STATS, "files", swept_files)
+        pipeline.hincrby(TEMP_FILE_SWEEP_STATS, "bytes", swept_bytes)
+        pipeline.hset(TEMP_FILE_SWEEP_STATS, "last_run", timezone.now().isoformat())
+        pipeline.execute()
+        logger.info(f"Swept {swept_files} temporary files, reclaimed {swept_bytes} bytes")
+    return {"files": swept_files, "bytes": swept_bytes}
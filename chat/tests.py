@@ -1,3 +1,165 @@
-from django.test import TestCase
+import uuid
+from datetime import timedelta
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from previews.models import MediaVariant
+from utils.pagination import encode_cursor
+from .models import ChatRoom, File, Message, RoomMember
+from .routing import websocket_urlpatterns
+
+
+class MessageHistoryQueryTests(TestCase):
+    def setUp(self):
+        self.sender = CustomUser.objects.create_user(email="sender@example.com", username="history_sender")
+        self.reader = CustomUser.objects.create_user(email="reader@example.com", username="history_reader")
+        self.room = ChatRoom.objects.create(room_type=ChatRoom.GROUP, name="history")
+        RoomMember.objects.create(room=self.room, user=self.sender)
+        RoomMember.objects.create(room=self.room, user=self.reader)
+        # One deduplicated file shared by every message, plus one of their own
+        self.shared = self._file()
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+        self.url = reverse("messages-list-by-room", kwargs={"room_id": self.room.id})
+
+    def _file(self):
+        unique_id = uuid.uuid4().hex
+        file = File.objects.create(
+            unique_id=unique_id, file=f"chat_files/{unique_id}.png", file_type="image", is_temporary=False
+        )
+        MediaVariant.objects.create(
+            content_type=ContentType.objects.get_for_model(File), object_id=str(file.pk),
+            kind="thumb", format="webp", file=f"previews/{unique_id}.webp", width=160, height=80,
+        )
+        return file
+
+    def _add_messages(self, count):
+        for i in range(count):
+            message = Message.objects.create(room=self.room, sender=self.sender, text=f"message {i}")
+            message.attachments.add(self.shared, self._file())
+
+    def _history(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"limit": 100})
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"], len(queries)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self._add_messages(5)
+        results, small_page = self._history()
+        self.assertEqual(len(results), 5)
+
+        self._add_messages(15)
+        results, large_page = self._history()
+        self.assertEqual(len(results), 20)
+        self.assertEqual(large_page, small_page)
+
+    def test_attachments_leave_out_relations(self):
+        self._add_messages(2)
+        results, _ = self._history()
+
+        attachment = results[0]["attachments"][0]
+        self.assertEqual(set(attachment), {"id", "file", "file_type", "file_size", "variants"})
+        self.assertIn("thumb", attachment["variants"])
+
+
+class WatermarkBackfillTests(TransactionTestCase):
+    migrate_from = [("chat", "0009_alter_message_created_at")]
+    migrate_to = [("chat", "0010_roommember_watermarks")]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.seed(executor.loader.project_state(self.migrate_from).apps)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        self.RoomMember = executor.loader.project_state(self.migrate_to).apps.get_model("chat", "RoomMember")
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def seed(self, apps):
+        ChatRoom = apps.get_model("chat", "ChatRoom")
+        RoomMember = apps.get_model("chat", "RoomMember")
+        Message = apps.get_model("chat", "Message")
+        MessageStatus = apps.get_model("chat", "MessageStatus")
+
+        # Only chat is rolled back, so users come from the live accounts table
+        sender, gapped, caught_up = [
+            CustomUser.objects.create_user(email=f"{name}@example.com", username=name)
+            for name in ("backfill_sender", "backfill_gapped", "backfill_caught_up")
+        ]
+        room = ChatRoom.objects.create(room_type="group", name="backfill")
+        for user in (sender, gapped, caught_up):
+            RoomMember.objects.create(room=room, user_id=user.pk)
+
+        start = timezone.now() - timedelta(hours=1)
+        self.messages = []
+        for i in range(4):
+            message = Message.objects.create(room=room, sender_id=sender.pk, text=str(i))
+            Message.objects.filter(pk=message.pk).update(created_at=start + timedelta(minutes=i))
+            self.messages.append(Message.objects.get(pk=message.pk))
+
+        # gapped: read, delivered only, never delivered, read (newest)
+        for message, (is_delivered, is_read) in zip(
+            self.messages, [(True, True), (True, False), (False, False), (True, True)]
+        ):
+            MessageStatus.objects.create(message=message, user_id=gapped.pk, is_delivered=is_delivered, is_read=is_read)
+            MessageStatus.objects.create(message=message, user_id=caught_up.pk, is_delivered=True, is_read=True)
+        self.users = {"sender": sender.pk, "gapped": gapped.pk, "caught_up": caught_up.pk}
+
+    def member(self, name):
+        return self.RoomMember.objects.get(user_id=self.users[name])
+
+    def test_watermarks_stop_before_the_oldest_gap(self):
+        member = self.member("gapped")
+        self.assertEqual(member.last_read_message_id, self.messages[0].pk)
+        self.assertEqual(member.last_read_at, self.messages[0].created_at)
+        self.assertEqual(member.last_delivered_at, self.messages[1].created_at)
+
+    def test_watermarks_without_gaps_take_the_newest(self):
+        member = self.member("caught_up")
+        self.assertEqual(member.last_read_message_id, self.messages[-1].pk)
+        self.assertEqual(member.last_delivered_at, self.messages[-1].created_at)
+
+    def test_sender_without_statuses_has_no_watermark(self):
+        member = self.member("sender")
+        self.assertIsNone(member.last_read_at)
+        self.assertIsNone(member.last_delivered_at)
+
+
+class FetchUndeliveredCursorTests(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="socket@example.com", username="socket_user")
+
+    async def test_malformed_cursor_gets_an_error_frame(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/chat/")
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        try:
+            for cursor in [42, ["a"], {"created_at": "x"}, "not a cursor", encode_cursor(timezone.now(), "not-a-uuid")]:
+                await communicator.send_json_to({"type": "fetch_undelivered", "cursor": cursor})
+                frame = await communicator.receive_json_from()
+                self.assertEqual(
+                    frame, {"event": "fetch_undelivered", "type": "error", "message": "Invalid cursor"}, cursor
+                )
+
+            # The socket survived every bad frame
+            await communicator.send_json_to({"type": "ping"})
+            self.assertEqual(await communicator.receive_json_from(), {"type": "pong"})
+        finally:
+            await communicator.disconnect()
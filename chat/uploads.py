@@ -0,0 +1,79 @@
+import os
+import hashlib
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.utils import timezone
+
+redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+
+READ_CHUNK_SIZE = 64 * 1024
+# Held while a chunk streams in or the session finalizes, so two requests
+# never write the same part file
+SESSION_LOCK_TTL = 10 * 60
+
+
+class AssembledUpload(DjangoFile):
+    """
+    A finished part file handed to FileManager. `temporary_file_path` lets
+    FileSystemStorage move it into MEDIA_ROOT rather than copy it.
+    """
+    def __init__(self, path, name, sha256):
+        super().__init__(open(path, "rb"), name=name)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def session_expiry():
+    return timezone.now() + timedelta(seconds=settings.CHAT_UPLOAD_SESSION_TTL)
+
+
+def lock_session(session_id):
+    return bool(redis_client.set(f"upload_session_lock:{session_id}", 1, nx=True, ex=SESSION_LOCK_TTL))
+
+
+def unlock_session(session_id):
+    redis_client.delete(f"upload_session_lock:{session_id}")
+
+
+def append_chunk(session, stream, length):
+    """
+    Writes up to `length` bytes from `stream` at the session offset and returns
+    how many arrived. Bytes past the recorded offset, left by a chunk that
+    died mid-write, are truncated first.
+    """
+    os.makedirs(settings.CHAT_UPLOAD_SESSION_DIR, exist_ok=True)
+    mode = "r+b" if os.path.exists(session.part_path) else "wb"
+    written = 0
+    with open(session.part_path, mode) as part:
+        part.seek(session.offset)
+        part.truncate()
+        while written < length:
+            data = stream.read(min(READ_CHUNK_SIZE, length - written))
+            if not data:
+                break
+            part.write(data)
+            written += len(data)
+    return written
+
+
+def assemble(session):
+    """Hashes the complete part file and wraps it for FileManager."""
+    hasher = hashlib.sha256()
+    with open(session.part_path, "rb") as part:
+        for data in iter(lambda: part.read(READ_CHUNK_SIZE), b""):
+            hasher.update(data)
+    name = os.path.basename(session.filename) or f"{session.id}.bin"
+    return AssembledUpload(session.part_path, name, hasher.hexdigest())
+
+
+def discard_part(session_id):
+    try:
+        os.remove(os.path.join(settings.CHAT_UPLOAD_SESSION_DIR, f"{session_id}.part"))
+    except FileNotFoundError:
+        pass
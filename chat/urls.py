@@ -4,7 +4,8 @@ from .views import (
     ChatRoomViewSet,
     RoomMemberViewSet,
     MessageViewSet,
-    FileViewSet
+    FileViewSet,
+    UploadSessionViewSet
 )
 
 router = DefaultRouter()
@@ -12,6 +13,7 @@ router.register(r'rooms', ChatRoomViewSet, basename='chatroom')
 router.register(r'members', RoomMemberViewSet, basename="room_members")
 router.register(r'message', MessageViewSet, basename="messages")
 router.register(r'files', FileViewSet, basename="files")
+router.register(r'uploads', UploadSessionViewSet, basename="uploads")
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,14 +1,15 @@
-from django.db.models import Sum
 from django.core.exceptions import ValidationError
 
-from .models import File
-MAX_STORAGE = 200 * 1024 * 1024
+from .cache import get_storage_used
+from .models import MAX_STORAGE, STORAGE_LIMIT_MESSAGE
 
 def get_user_storage_usage(user) -> int:
-    return File.objects.filter(owners=user).aggregate(total_size=Sum("file_size"))["total_size"] or 0
+    return get_storage_used(user.id)
 
-def validate_user_storage(user, new_file):
+def validate_storage_size(user, size):
     used = get_user_storage_usage(user)
-    new_file_size = getattr(new_file, "size", 0)
-    if used + new_file_size > MAX_STORAGE:
-        raise ValidationError("Storage limit reached! Delete old files to upload new ones.")
+    if used + size > MAX_STORAGE:
+        raise ValidationError(STORAGE_LIMIT_MESSAGE)
+
+def validate_user_storage(user, new_file):
+    validate_storage_size(user, getattr(new_file, "size", 0))
@@ -3,21 +3,27 @@ from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
 from rest_framework import viewsets, permissions, status
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.exceptions import ValidationError
-from django.db.models import Count, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count
 
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
+from .cache import get_storage_used, get_unread_counts, invalidate_storage_used, store_unread_counts
 from .consumers import redis_client
-from .models import ChatRoom, Message, File, RoomMember
-from .pagination import CustomLimitOffsetPagination
+from .models import MAX_STORAGE, ChatRoom, Message, MessageAction, File, RoomMember, StorageUsage, UploadSession
+from .pagination import MessageCursorPagination
 from .serializers import (
     ChatRoomSerializer,
     MessageSerializer,
+    MessageHistorySerializer,
     FileSerializer,
-    RoomMemberSerializer
+    RoomMemberSerializer,
+    UploadSessionSerializer
 )
+from .uploads import append_chunk, assemble, discard_part, lock_session, session_expiry, unlock_session
 
 
 # Chat Room ViewSet
@@ -33,19 +39,26 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         return (
             ChatRoom.objects
             .filter(members=self.request.user)
-            .annotate(
-                unread_count=Count(
-                    "messages__statuses",
-                    filter=Q(
-                        messages__statuses__user=self.request.user,
-                        messages__statuses__is_read=False
-                    )
-                )
-            )
             .prefetch_related("room_members", "room_members__user")
             .order_by("-created_at")
         )
 
+    def attach_unread_counts(self, rooms):
+        counts = get_unread_counts(self.request.user.id, [room.id for room in rooms])
+        for room in rooms:
+            room.unread_count = counts.get(str(room.id), 0)
+        return rooms
+
+    def list(self, request, *args, **kwargs):
+        rooms = self.attach_unread_counts(list(self.filter_queryset(self.get_queryset())))
+        serializer = self.get_serializer(rooms, many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        room, = self.attach_unread_counts([self.get_object()])
+        serializer = self.get_serializer(room)
+        return Response(serializer.data)
+
 
     def create(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data, context={"request": request})
@@ -131,6 +144,7 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             return Response({"detail": "In group chats, only the owner or admin can clear messages."}, status=403)
 
         room.messages.all().delete()
+        store_unread_counts({user_id: {room.id: 0} for user_id in room.members.values_list("id", flat=True)})
 
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
@@ -297,7 +311,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
-    pagination_class = CustomLimitOffsetPagination
+    pagination_class = MessageCursorPagination
     http_method_names = ['get', 'delete', 'head', 'options']
 
     def get_queryset(self):
@@ -307,14 +321,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         qs = (
             Message.objects
             .filter(room__members=self.request.user)
-            .select_related("sender", "room", "reply_to")
-            .prefetch_related(
-                "attachments",
-                "statuses",
-                "statuses__user",
-                "actions",
-                "actions__user"
-            )
+            .prefetch_related("attachments", "attachments__variants")
         )
 
         room_id = self.request.query_params.get("room_id")
@@ -322,11 +329,68 @@ class MessageViewSet(viewsets.ModelViewSet):
             qs = qs.filter(room_id=room_id)
         return qs.order_by("-created_at")
 
+    def get_serializer_class(self):
+        if self.action in ("list", "list_by_room"):
+            return MessageHistorySerializer
+        return MessageSerializer
+
+    def get_history_context(self, messages):
+        """
+        Everything MessageHistorySerializer needs for a page in three queries:
+        the rooms' member watermarks, reaction counts and the caller's reactions.
+        """
+        room_ids = {message.room_id for message in messages}
+        message_ids = [message.id for message in messages]
+
+        read_marks, delivered_marks, member_marks = defaultdict(list), defaultdict(list), {}
+        members = RoomMember.objects.filter(room_id__in=room_ids).values_list(
+            "room_id", "user_id", "last_read_at", "last_delivered_at"
+        )
+        for room_id, user_id, read_at, delivered_at in members:
+            member_marks[(room_id, user_id)] = (read_at, delivered_at)
+            if read_at:
+                read_marks[room_id].append(read_at)
+            if delivered_at:
+                delivered_marks[room_id].append(delivered_at)
+        for marks in (*read_marks.values(), *delivered_marks.values()):
+            marks.sort()
+
+        reactions = defaultdict(dict)
+        counts = (
+            MessageAction.objects
+            .filter(message_id__in=message_ids)
+            .values_list("message_id", "value")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        for message_id, value, count in counts:
+            reactions[message_id][value] = count
+
+        my_reactions = dict(
+            MessageAction.objects
+            .filter(message_id__in=message_ids, user=self.request.user)
+            .values_list("message_id", "value")
+        )
+
+        return {
+            "read_marks": read_marks,
+            "delivered_marks": delivered_marks,
+            "member_marks": member_marks,
+            "reactions": reactions,
+            "my_reactions": my_reactions,
+        }
+
+    def get_history_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        context = {**self.get_serializer_context(), **self.get_history_context(page)}
+        serializer = MessageHistorySerializer(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+
     def list(self, request, *args, **kwargs):
         messages = self.get_queryset()
-        if not messages:
+        if not messages.exists():
             return Response({"detail": "Message not found."}, status=404)
-        return super().list(request, *args, **kwargs)
+        return self.get_history_response(messages)
 
     def perform_create(self, serializer):
         room = serializer.validated_data.get("room")
@@ -375,14 +439,28 @@ class MessageViewSet(viewsets.ModelViewSet):
         if not room.members.filter(id=request.user.id).exists():
             return Response({"detail": "You are not a member of this room."}, status=403)
 
-        qs = Message.objects.filter(room=room).order_by("-created_at")
-        page = self.paginate_queryset(qs)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(qs, many=True)
-        return Response(serializer.data, status=200)
+        qs = Message.objects.filter(room=room).prefetch_related("attachments", "attachments__variants")
+        return self.get_history_response(qs)
+
+    @action(detail=True, methods=["get"])
+    def receipts(self, request, pk=None):
+        message = self.get_object()
+        reactions = dict(MessageAction.objects.filter(message=message).values_list("user_id", "value"))
+        members = (
+            RoomMember.objects
+            .filter(room_id=message.room_id)
+            .exclude(user_id=message.sender_id)
+            .values_list("user_id", "last_delivered_at", "last_read_at")
+        )
+        return Response([
+            {
+                "user": user_id,
+                "is_delivered": bool(delivered_at and delivered_at >= message.created_at),
+                "is_read": bool(read_at and read_at >= message.created_at),
+                "reaction": reactions.get(user_id),
+            }
+            for user_id, delivered_at, read_at in members
+        ], status=200)
 
 
 # File ViewSet
@@ -395,7 +473,7 @@ class FileViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if getattr(self, "swagger_fake_view", False):
             return File.objects.none()
-        return File.objects.filter(owners=self.request.user).select_related("message", "message__sender")
+        return File.objects.filter(owners=self.request.user).prefetch_related("variants")
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -404,7 +482,131 @@ class FileViewSet(viewsets.ModelViewSet):
                 {"detail": "You can only delete your own files."},
                 status=status.HTTP_403_FORBIDDEN
             )
-        if instance.owners.count() > 1:
-            instance.owners.remove(request.user)
-            return Response(status=204)
-        return super().destroy(request, *args, **kwargs)
+        with transaction.atomic():
+            StorageUsage.objects.release(request.user.id, instance.file_size)
+            if instance.owners.count() > 1:
+                instance.owners.remove(request.user)
+                return Response(status=204)
+            # Deleting the file drops its owner links without m2m_changed
+            transaction.on_commit(lambda: invalidate_storage_used([request.user.id]))
+            return super().destroy(request, *args, **kwargs)
+
+    @action(detail=False, methods=["get"])
+    def usage(self, request):
+        return Response({"storage_used": get_storage_used(request.user.id), "storage_limit": MAX_STORAGE})
+
+
+# Resumable upload ViewSet: POST a session, PATCH raw chunks with an
+# Upload-Offset header, then POST finalize to turn it into a File
+class UploadSessionViewSet(viewsets.GenericViewSet):
+    serializer_class = UploadSessionSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        if getattr(self, "swagger_fake_view", False):
+            return UploadSession.objects.none()
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    def _offset_response(self, session, status_code=200):
+        response = Response(self.get_serializer(session).data, status=status_code)
+        response["Upload-Offset"] = str(session.offset)
+        response["Upload-Length"] = str(session.total_size)
+        return response
+
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = serializer.save()
+        return self._offset_response(session, status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return self._offset_response(self.get_object())
+
+    def partial_update(self, request, pk=None):
+        session_id = self.get_object().pk
+        try:
+            offset = int(request.headers["Upload-Offset"])
+            length = int(request.headers.get("Content-Length") or 0)
+        except (KeyError, ValueError):
+            raise ValidationError({"detail": "Upload-Offset and Content-Length headers are required."})
+
+        if not lock_session(session_id):
+            return Response({"detail": "Another chunk is still uploading."}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            # The offset is only trusted once read under the lock
+            session = self._locked_session(session_id)
+            if offset != session.offset:
+                return self._offset_conflict(session, "Offset mismatch.")
+            if length <= 0 or offset + length > session.total_size:
+                raise ValidationError({"detail": "Chunk runs past total_size."})
+
+            # Read the raw body straight to disk; request.data is never parsed
+            written = append_chunk(session, request.stream, length)
+            session.offset += written
+            session.expires_at = session_expiry()
+            updated = UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+                offset=session.offset, expires_at=session.expires_at
+            )
+            if not updated:
+                # Deleted or moved by a request that did not hold the lock
+                return self._offset_conflict(self._locked_session(session_id), "Session changed during upload.")
+        finally:
+            unlock_session(session_id)
+        return self._offset_response(session)
+
+    def _locked_session(self, session_id):
+        session = UploadSession.objects.filter(pk=session_id, owner=self.request.user).first()
+        if session is None:
+            raise NotFound()
+        return session
+
+    def _offset_conflict(self, session, detail):
+        # The client resumes from the offset it reads back here
+        return Response(
+            {"detail": detail, "offset": session.offset},
+            status=status.HTTP_409_CONFLICT, headers={"Upload-Offset": str(session.offset)}
+        )
+
+    def destroy(self, request, pk=None):
+        session = self.get_object()
+        session_id = session.pk
+        if not lock_session(session_id):
+            return Response({"detail": "Another chunk is still uploading."}, status=status.HTTP_409_CONFLICT)
+        try:
+            session.delete()
+            discard_part(session_id)
+        finally:
+            unlock_session(session_id)
+        return Response(status=204)
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        session_id = self.get_object().pk
+        if not lock_session(session_id):
+            return Response({"detail": "Another chunk is still uploading."}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            session = self._locked_session(session_id)
+            if session.offset != session.total_size:
+                return self._offset_conflict(session, "Upload is incomplete.")
+            upload = assemble(session)
+            try:
+                # Reserves quota again: other uploads may have finished meanwhile.
+                # Over quota the session is kept so the user can free space and retry.
+                file, created = File.objects.get_or_create_with_owner(
+                    uploaded_file=upload,
+                    owner=request.user,
+                    file_type=session.file_type,
+                )
+            finally:
+                upload.close()
+            session.delete()
+            # A dedup hit never moved the part file into storage
+            discard_part(session_id)
+        finally:
+            unlock_session(session_id)
+
+        serializer = FileSerializer(file, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else 200)
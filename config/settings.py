@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     'stories.apps.StoriesConfig',
     'notifications.apps.NotificationsConfig',
     'posts.apps.PostsConfig',
+    'previews.apps.PreviewsConfig',
 ]
 
 MIDDLEWARE = [
@@ -156,6 +157,22 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Hash uploads while they stream so chat File dedup needs no second read
+FILE_UPLOAD_HANDLERS = [
+    'chat.upload_handlers.HashingMemoryFileUploadHandler',
+    'chat.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+
+# Part files of resumable chat uploads; keep on the same filesystem as MEDIA_ROOT
+# so a finished upload is moved into storage instead of copied
+CHAT_UPLOAD_SESSION_DIR = os.getenv('CHAT_UPLOAD_SESSION_DIR', os.path.join(BASE_DIR, 'upload_sessions'))
+CHAT_UPLOAD_SESSION_TTL = int(os.getenv('CHAT_UPLOAD_SESSION_TTL', 24 * 60 * 60))
+# Uploads still not attached to a message after this many seconds are swept
+CHAT_TEMP_FILE_TTL = int(os.getenv('CHAT_TEMP_FILE_TTL', 24 * 60 * 60))
+
+# Used by previews to grab video poster frames; videos get no preview when it is missing
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GOOGLE_CLIENT_ID = '511430879592-7sns7n9se04m74ma6pqrt7k8kujr1th7.apps.googleusercontent.com'
@@ -175,7 +192,49 @@ CELERY_BEAT_SCHEDULE = {
         "task": "stories.tasks.check_story_time",
         "schedule": 60,
     },
+    "flush_chat_message_stream": {
+        "task": "chat.tasks.flush_message_stream",
+        "schedule": 2,
+    },
+    "reconcile_chat_unread_counters": {
+        "task": "chat.tasks.reconcile_unread_counters",
+        "schedule": 600,
+    },
+    "reconcile_notification_unread_counters": {
+        "task": "notifications.tasks.reconcile_unread_notification_counters",
+        "schedule": 600,
+    },
+    "flush_post_views": {
+        "task": "posts.tasks.flush_post_views",
+        "schedule": 10,
+    },
+    "archive_old_notifications": {
+        "task": "notifications.tasks.archive_old_notifications",
+        "schedule": 3600,
+    },
+    "expire_chat_upload_sessions": {
+        "task": "chat.tasks.expire_upload_sessions",
+        "schedule": 3600,
+    },
+    "sweep_chat_temporary_files": {
+        "task": "chat.tasks.sweep_temporary_files",
+        "schedule": 600,
+    },
+}
+
+# Broadcast chat messages before persisting them; chat.tasks.flush_message_stream
+# writes them from a Redis Stream in batches
+CHAT_WRITE_BEHIND = os.getenv('CHAT_WRITE_BEHIND', 'False') == 'True'
+
+# Push delivery; set to notifications.backends.LocalBackend to run without Firebase
+FCM_BACKEND = os.getenv('FCM_BACKEND', 'notifications.backends.FirebaseBackend')
+
+# Seconds to collect a burst of chat messages into one push, per room type; 0 sends each message
+NOTIFICATION_COALESCE_WINDOWS = {
+    'private': int(os.getenv('NOTIFICATION_COALESCE_PRIVATE', 10)),
+    'group': int(os.getenv('NOTIFICATION_COALESCE_GROUP', 30)),
 }
+NOTIFICATION_RETENTION_DAYS = int(os.getenv('NOTIFICATION_RETENTION_DAYS', 90))
 
 CHANNEL_LAYERS = {
     "default": {
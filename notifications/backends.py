@@ -0,0 +1,55 @@
+import logging
+import firebase_admin
+from firebase_admin import messaging
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# The only send errors that mean the token itself is dead
+UNREGISTERED_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+
+
+class FirebaseBackend:
+    """Sends multicasts through firebase_admin; initialized in notifications.utils."""
+
+    def is_available(self):
+        return bool(firebase_admin._apps)
+
+    def send_multicast(self, tokens, title, body, data):
+        """
+        Returns (success_count, tokens that are no longer registered). Other
+        failures (quota, outages, bad payloads) are logged and the token kept.
+        """
+        message = messaging.MulticastMessage(
+            notification=messaging.Notification(title=title, body=body),
+            data=data,
+            tokens=tokens,
+        )
+        response = messaging.send_each_for_multicast(message)
+        invalid_tokens = []
+        for token, resp in zip(tokens, response.responses):
+            if not resp.success:
+                logger.warning(f"[FCM] Failed to send to token {token[:12]}...: {resp.exception}")
+                if isinstance(resp.exception, UNREGISTERED_ERRORS):
+                    invalid_tokens.append(token)
+        return response.success_count, invalid_tokens
+
+
+class LocalBackend:
+    """
+    Offline stand-in for Firebase: records every multicast in memory so
+    fan-out can be exercised and benchmarked without network access.
+    """
+    sent = []
+
+    def is_available(self):
+        return True
+
+    def send_multicast(self, tokens, title, body, data):
+        self.sent.append({"tokens": list(tokens), "title": title, "body": body, "data": data})
+        return len(tokens), []
+
+
+def get_push_backend():
+    return import_string(settings.FCM_BACKEND)()
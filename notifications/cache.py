@@ -0,0 +1,148 @@
+import time
+
+import redis
+
+from .models import FCMDevice, Notification
+
+redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+
+DEVICE_TOKENS_TTL = 24 * 60 * 60
+# Stored alongside the tokens so a user with no devices is still a cache hit
+_LOADED = "-"
+
+DEAD_TOKENS_KEY = "fcm_dead_tokens"
+# Deleting a device already drops its owner's cached set (notifications.signals);
+# a tombstone only has to outlive a set refilled just before that delete
+DEAD_TOKENS_TTL = DEVICE_TOKENS_TTL
+
+
+def online_user_ids(user_ids):
+    user_ids = list(user_ids)
+    pipeline = redis_client.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipeline.get(f"online_user:{user_id}")
+    return {user_id for user_id, online in zip(user_ids, pipeline.execute()) if online == "1"}
+
+
+def _device_tokens_key(user_id):
+    return f"fcm_tokens:{user_id}"
+
+
+def get_device_tokens(user_ids):
+    """
+    Device tokens per user from the Redis sets; only users missing from the
+    cache are loaded, in one query, and written back.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipeline.smembers(_device_tokens_key(user_id))
+    tokens = {}
+    missing = []
+    for user_id, cached in zip(user_ids, pipeline.execute()):
+        if cached:
+            tokens[user_id] = [token for token in cached if token != _LOADED]
+        else:
+            missing.append(user_id)
+
+    if missing:
+        loaded = {user_id: [] for user_id in missing}
+        for user_id, token in FCMDevice.objects.filter(user_id__in=missing).values_list('user_id', 'registration_token'):
+            loaded[user_id].append(token)
+        pipeline = redis_client.pipeline(transaction=False)
+        for user_id, user_tokens in loaded.items():
+            key = _device_tokens_key(user_id)
+            pipeline.sadd(key, _LOADED, *user_tokens)
+            pipeline.expire(key, DEVICE_TOKENS_TTL)
+        pipeline.execute()
+        tokens.update(loaded)
+    return tokens
+
+
+def invalidate_device_tokens(*user_ids):
+    if user_ids:
+        redis_client.delete(*(_device_tokens_key(user_id) for user_id in user_ids))
+
+
+def bury_tokens(tokens):
+    """
+    Tombstones tokens Firebase reported as unregistered so a cached copy is
+    not retried; re-registering the token lifts it (see revive_token).
+    """
+    if not tokens:
+        return
+    now = time.time()
+    pipeline = redis_client.pipeline()
+    pipeline.zadd(DEAD_TOKENS_KEY, {token: now for token in tokens})
+    pipeline.zremrangebyscore(DEAD_TOKENS_KEY, 0, now - DEAD_TOKENS_TTL)
+    pipeline.execute()
+
+
+def revive_token(token):
+    redis_client.zrem(DEAD_TOKENS_KEY, token)
+
+
+def live_tokens(tokens):
+    if not tokens:
+        return []
+    scores = redis_client.zmscore(DEAD_TOKENS_KEY, tokens)
+    # Expired tombstones linger until the next bury_tokens trims them
+    expired = time.time() - DEAD_TOKENS_TTL
+    return [token for token, score in zip(tokens, scores) if score is None or score < expired]
+
+
+# Unread notification counters: notif_unread:{user_id} -> count. Deltas only
+# apply to counters that exist; a missing counter is counted from the
+# database on first read.
+UNREAD_TTL = 24 * 60 * 60
+
+_ADJUST_EXISTING = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        if redis.call('INCRBY', key, ARGV[i]) < 0 then
+            redis.call('SET', key, 0, 'KEEPTTL')
+        end
+    end
+end
+return 0
+"""
+
+
+def _unread_key(user_id):
+    return f"notif_unread:{user_id}"
+
+
+def adjust_unread_counts(deltas):
+    """Applies {user_id: delta} to the counters that are already cached."""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if deltas:
+        redis_client.eval(
+            _ADJUST_EXISTING, len(deltas),
+            *(_unread_key(user_id) for user_id in deltas), *deltas.values()
+        )
+
+
+def get_unread_count(user_id):
+    cached = redis_client.get(_unread_key(user_id))
+    if cached is not None:
+        return int(cached)
+
+    count = Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+    # NX keeps a counter another request created meanwhile
+    redis_client.set(_unread_key(user_id), count, ex=UNREAD_TTL, nx=True)
+    return count
+
+
+def store_unread_counts(counts):
+    pipeline = redis_client.pipeline(transaction=False)
+    for user_id, count in counts.items():
+        pipeline.set(_unread_key(user_id), count, ex=UNREAD_TTL)
+    pipeline.execute()
+
+
+def scan_unread_user_ids(count=500):
+    for key in redis_client.scan_iter(match=_unread_key("*"), count=count):
+        yield int(key.split(":", 1)[1])
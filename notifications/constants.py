@@ -11,5 +11,7 @@ REPLY_BODY = "{user} sizning izohingizga javob berdi."
 
 MESSAGE_TITLE = "Yangi xabar!"
 MESSAGE_BODY = "{user}: {text}"
+MESSAGE_BURST_BODY = "{user}: {count} ta yangi xabar"
+MESSAGE_BURST_MIXED_BODY = "{count} ta yangi xabar"
 
 SYSTEM_TITLE = "Tizim xabari"
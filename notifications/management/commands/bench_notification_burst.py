@@ -0,0 +1,64 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from accounts.models import CustomUser
+from chat.models import ChatRoom, Message, RoomMember
+from notifications.backends import LocalBackend
+from notifications.models import FCMDevice, Notification
+from notifications.tasks import fanout_message, flush_bursts
+
+
+class Command(BaseCommand):
+    help = "Replays a chat burst to offline users with and without coalescing (local push backend, rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=30)
+        parser.add_argument("--recipients", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            room, sender = self._seed(options["recipients"])
+            messages = [
+                Message(room=room, sender=sender, text=f"burst {i}")
+                for i in range(options["messages"])
+            ]
+            Message.objects.bulk_create(messages)
+
+            with override_settings(FCM_BACKEND="notifications.backends.LocalBackend"):
+                with override_settings(NOTIFICATION_COALESCE_WINDOWS={}):
+                    direct = self._replay(room, messages)
+                with override_settings(NOTIFICATION_COALESCE_WINDOWS={room.room_type: 30}):
+                    coalesced = self._replay(room, messages)
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{options['messages']} messages to {options['recipients']} offline recipients")
+        self.stdout.write(f"per message: {direct[0]:>6} notification rows  {direct[1]:>4} push calls  {direct[2]:>6} device pushes")
+        self.stdout.write(f"coalesced:   {coalesced[0]:>6} notification rows  {coalesced[1]:>4} push calls  {coalesced[2]:>6} device pushes")
+
+    def _seed(self, recipients):
+        suffix = uuid.uuid4().hex[:8]
+        users = CustomUser.objects.bulk_create([
+            CustomUser(email=f"bench-{i}-{suffix}@example.com", username=f"bench_{i}_{suffix}")
+            for i in range(recipients + 1)
+        ])
+        room = ChatRoom.objects.create(room_type=ChatRoom.GROUP, name=f"bench {suffix}")
+        RoomMember.objects.bulk_create([RoomMember(room=room, user=user) for user in users])
+        FCMDevice.objects.bulk_create([
+            FCMDevice(user=user, registration_token=f"bench-{suffix}-{user.id}") for user in users[1:]
+        ])
+        return room, users[0]
+
+    def _replay(self, room, messages):
+        rows_before = Notification.objects.filter(data__room_id=str(room.id)).count()
+        LocalBackend.sent.clear()
+        pending = set()
+        for message in messages:
+            pending.update(fanout_message(message))
+        if pending:
+            flush_bursts(str(room.id), list(pending))
+        rows = Notification.objects.filter(data__room_id=str(room.id)).count() - rows_before
+        return rows, len(LocalBackend.sent), sum(len(sent["tokens"]) for sent in LocalBackend.sent)
@@ -2,6 +2,8 @@ from django.db import models
 from django.conf import settings
 from uuid import uuid4
 
+from accounts.models import CustomUser
+
 
 class Notification(models.Model):
     NOTIFICATION_TYPES = (
@@ -23,11 +25,34 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read'], name='notification_recipient_read'),
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notification_recipient_recent'),
+            # Retention sweep: archive_old_notifications pages by age across all recipients
+            models.Index(fields=['created_at'], name='notification_created'),
+        ]
 
     def __str__(self):
         return f"{self.notification_type} to {self.recipient.email}"
 
 
+class ArchivedNotification(models.Model):
+    """Cold copy of notifications past the retention window; see archive_old_notifications."""
+    id = models.CharField(max_length=128, primary_key=True)
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_notifications')
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    data = models.JSONField(default=dict, blank=True)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.notification_type} to {self.recipient_id} (archived)"
+
+
 class FCMDevice(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='fcm_devices')
     registration_token = models.TextField(unique=True)
@@ -37,3 +62,43 @@ class FCMDevice(models.Model):
 
     def __str__(self):
         return f"{self.user.email} - {self.device_type}"
+
+
+class BroadcastJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='broadcast_jobs', null=True)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    # Empty means every active user
+    user_ids = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default=PENDING)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.title} ({self.status})"
+
+    def recipients(self):
+        queryset = CustomUser.objects.filter(is_active=True)
+        if self.user_ids:
+            queryset = queryset.filter(id__in=self.user_ids)
+        return queryset
@@ -1,7 +1,8 @@
 from rest_framework import serializers
 from django.utils import timezone
 from django.utils.timesince import timesince
-from .models import Notification, FCMDevice
+from .cache import invalidate_device_tokens, revive_token
+from .models import BroadcastJob, Notification, FCMDevice
 from accounts.models import CustomUser
 
 
@@ -88,6 +89,7 @@ class FCMDeviceSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         # Token unikal bo'lishi kerak, mavjud bo'lsa yangilaymiz
         token = validated_data.get('registration_token')
+        previous_owner = FCMDevice.objects.filter(registration_token=token).values_list('user_id', flat=True).first()
         device, created = FCMDevice.objects.update_or_create(
             registration_token=token,
             defaults={
@@ -95,6 +97,9 @@ class FCMDeviceSerializer(serializers.ModelSerializer):
                 'device_type': validated_data.get('device_type', 'web')
             }
         )
+        # Qayta ro'yxatdan o'tgan token yana tirik hisoblanadi
+        revive_token(token)
+        invalidate_device_tokens(*{user.id, previous_owner} - {None})
         return device
 
 
@@ -106,3 +111,21 @@ class SystemNotificationSerializer(serializers.Serializer):
         required=False,
         help_text="Tanlangan userlar IDlari. Bo'sh bo'lsa hamma userga yuboriladi."
     )
+
+
+class BroadcastJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BroadcastJob
+        fields = [
+            'id', 'title', 'body', 'status',
+            'total', 'processed', 'sent', 'progress',
+            'error', 'created_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        if not obj.total:
+            return 100 if obj.status == BroadcastJob.COMPLETED else 0
+        return round(obj.processed * 100 / obj.total, 1)
@@ -0,0 +1,10 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .cache import invalidate_device_tokens
+from .models import FCMDevice
+
+
+@receiver(post_delete, sender=FCMDevice)
+def invalidate_tokens_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_device_tokens(instance.user_id))
@@ -0,0 +1,274 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+import redis
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from chat.models import Message, RoomMember
+from .constants import MESSAGE_TITLE, MESSAGE_BODY, MESSAGE_BURST_BODY, MESSAGE_BURST_MIXED_BODY
+from .cache import adjust_unread_counts, get_device_tokens, online_user_ids, scan_unread_user_ids, store_unread_counts
+from .models import ArchivedNotification, BroadcastJob, Notification
+from .utils import publish_in_band, send_push
+
+redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+
+BROADCAST_CHUNK_SIZE = 1000
+UNREAD_RECONCILE_CHUNK = 500
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_MAX_BATCHES = 50
+
+# Safety net so a burst whose flush task was lost does not linger forever
+BURST_TTL = 60 * 60
+
+
+def _burst_key(recipient_id, room_id):
+    return f"notif_burst:{recipient_id}:{room_id}"
+
+
+def message_preview(message, sender):
+    text = message.text
+    return MESSAGE_BODY.format(
+        user=sender.username or sender.email,
+        text=text[:50] + "..." if text and len(text) > 50 else text or "Fayl yuborildi"
+    )
+
+
+def offline_user_ids(user_ids):
+    online = online_user_ids(user_ids)
+    return [user_id for user_id in user_ids if user_id not in online]
+
+
+def coalesce_window(room_type):
+    return settings.NOTIFICATION_COALESCE_WINDOWS.get(room_type, 0)
+
+
+def deliver_notifications(notifications):
+    """
+    Bulk-inserts history rows, hands them to online recipients over the
+    WebSocket and pushes the rest, one multicast group per distinct
+    (type, title, body, data). Returns the number of device pushes sent.
+    """
+    if not notifications:
+        return 0
+    Notification.objects.bulk_create(notifications, batch_size=500)
+    adjust_unread_counts(Counter(n.recipient_id for n in notifications))
+
+    online = publish_in_band(notifications)
+    recipients = defaultdict(list)
+    for notification in notifications:
+        if notification.recipient_id in online:
+            continue
+        key = (notification.notification_type, notification.title, notification.body, tuple(notification.data.items()))
+        recipients[key].append(notification.recipient_id)
+    if not recipients:
+        return 0
+
+    tokens_by_user = get_device_tokens({user_id for user_ids in recipients.values() for user_id in user_ids})
+    sent = 0
+    for (notification_type, title, body, data), user_ids in recipients.items():
+        tokens = [token for user_id in user_ids for token in tokens_by_user[user_id]]
+        sent += send_push(tokens, title, body, notification_type, dict(data))
+    return sent
+
+
+def fanout_message(message):
+    """
+    Notifies the offline recipients of a message. With a coalescing window
+    the message is folded into each recipient's pending burst for the room
+    instead; returns the recipient ids whose burst this message opened and
+    who therefore need a flush scheduled.
+    """
+    sender = message.sender
+    member_ids = list(
+        RoomMember.objects
+        .filter(room_id=message.room_id)
+        .exclude(user_id=sender.id)
+        .values_list("user_id", flat=True)
+    )
+    recipient_ids = offline_user_ids(member_ids)
+    if not recipient_ids:
+        return []
+
+    data = {'room_id': str(message.room_id), 'message_id': str(message.id)}
+    body = message_preview(message, sender)
+    if not coalesce_window(message.room.room_type):
+        deliver_notifications([
+            Notification(
+                recipient_id=recipient_id,
+                sender=sender,
+                notification_type='message',
+                title=MESSAGE_TITLE,
+                body=body,
+                data=data,
+            )
+            for recipient_id in recipient_ids
+        ])
+        return []
+
+    pipeline = redis_client.pipeline()
+    for recipient_id in recipient_ids:
+        key = _burst_key(recipient_id, message.room_id)
+        pipeline.hincrby(key, "count", 1)
+        pipeline.hset(key, mapping={
+            f"sender:{sender.id}": sender.username or sender.email,
+            "body": body,
+            "message_id": str(message.id),
+        })
+        pipeline.expire(key, BURST_TTL)
+    counts = pipeline.execute()[::3]
+    return [recipient_id for recipient_id, count in zip(recipient_ids, counts) if count == 1]
+
+
+def flush_bursts(room_id, recipient_ids):
+    """
+    Turns each pending burst into a single history row and push: the message
+    preview for a burst of one, "<sender>: N new messages" when one member
+    sent them all and a sender-less "N new messages" when several did.
+    """
+    pipeline = redis_client.pipeline()
+    for recipient_id in recipient_ids:
+        key = _burst_key(recipient_id, room_id)
+        pipeline.hgetall(key)
+        pipeline.delete(key)
+    bursts = pipeline.execute()[::2]
+
+    notifications = []
+    for recipient_id, burst in zip(recipient_ids, bursts):
+        if not burst:
+            continue
+        count = int(burst["count"])
+        senders = {
+            int(field.split(":", 1)[1]): name for field, name in burst.items() if field.startswith("sender:")
+        }
+        if count == 1:
+            body = burst["body"]
+        elif len(senders) == 1:
+            body = MESSAGE_BURST_BODY.format(user=next(iter(senders.values())), count=count)
+        else:
+            body = MESSAGE_BURST_MIXED_BODY.format(count=count)
+        notifications.append(Notification(
+            recipient_id=recipient_id,
+            sender_id=next(iter(senders)) if len(senders) == 1 else None,
+            notification_type='message',
+            title=MESSAGE_TITLE,
+            body=body,
+            data={'room_id': str(room_id), 'message_id': burst["message_id"], 'count': count},
+        ))
+    deliver_notifications(notifications)
+    return len(notifications)
+
+
+@shared_task
+def notify_message_recipients(message_id):
+    message = Message.objects.select_related("sender", "room").filter(id=message_id).first()
+    if not message:
+        return 0
+
+    opened = fanout_message(message)
+    if opened:
+        flush_message_bursts.apply_async(
+            (str(message.room_id), opened), countdown=coalesce_window(message.room.room_type)
+        )
+    return len(opened)
+
+
+@shared_task
+def flush_message_bursts(room_id, recipient_ids):
+    return flush_bursts(room_id, recipient_ids)
+
+
+@shared_task
+def run_broadcast_job(job_id, after_id=0):
+    """
+    Sends one chunk of a system broadcast, keyset-paged by user id, then
+    queues the next chunk so no single task holds the whole audience.
+    """
+    job = BroadcastJob.objects.filter(id=job_id).first()
+    if not job or job.status in (BroadcastJob.COMPLETED, BroadcastJob.FAILED):
+        return
+    if job.status == BroadcastJob.PENDING:
+        job.status = BroadcastJob.RUNNING
+        job.total = job.recipients().count()
+        job.save(update_fields=['status', 'total'])
+
+    try:
+        user_ids = list(
+            job.recipients()
+            .filter(id__gt=after_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:BROADCAST_CHUNK_SIZE]
+        )
+        if not user_ids:
+            BroadcastJob.objects.filter(id=job.id).update(status=BroadcastJob.COMPLETED, finished_at=timezone.now())
+            return
+
+        sent = deliver_notifications([
+            Notification(
+                recipient_id=user_id,
+                sender=job.created_by,
+                notification_type='system',
+                title=job.title,
+                body=job.body,
+                data={'type': 'system'},
+            )
+            for user_id in user_ids
+        ])
+    except Exception as e:
+        BroadcastJob.objects.filter(id=job.id).update(status=BroadcastJob.FAILED, error=str(e), finished_at=timezone.now())
+        raise
+
+    BroadcastJob.objects.filter(id=job.id).update(processed=F('processed') + len(user_ids), sent=F('sent') + sent)
+    run_broadcast_job.delay(str(job.id), user_ids[-1])
+
+
+@shared_task
+def reconcile_unread_notification_counters():
+    """Rewrites every cached unread counter from one grouped count per chunk."""
+    user_ids = list(scan_unread_user_ids())
+    for i in range(0, len(user_ids), UNREAD_RECONCILE_CHUNK):
+        chunk = user_ids[i:i + UNREAD_RECONCILE_CHUNK]
+        counts = dict.fromkeys(chunk, 0)
+        counts.update(
+            Notification.objects
+            .filter(recipient_id__in=chunk, is_read=False)
+            .order_by()
+            .values('recipient_id')
+            .annotate(count=Count('id'))
+            .values_list('recipient_id', 'count')
+        )
+        store_unread_counts(counts)
+    return len(user_ids)
+
+
+@shared_task
+def archive_old_notifications():
+    """
+    Moves notifications older than NOTIFICATION_RETENTION_DAYS into the
+    archive table in batches, oldest first, so the hot table only holds
+    recent history.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.NOTIFICATION_RETENTION_DAYS)
+    fields = ['id', 'recipient_id', 'sender_id', 'notification_type', 'title', 'body', 'data', 'is_read', 'created_at']
+    archived = 0
+    for _ in range(ARCHIVE_MAX_BATCHES):
+        with transaction.atomic():
+            rows = list(
+                Notification.objects
+                .filter(created_at__lt=cutoff)
+                .order_by('created_at')
+                .values(*fields)[:ARCHIVE_BATCH_SIZE]
+            )
+            if not rows:
+                break
+            ArchivedNotification.objects.bulk_create(
+                [ArchivedNotification(**row) for row in rows], batch_size=500, ignore_conflicts=True
+            )
+            Notification.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        unread = Counter(row['recipient_id'] for row in rows if not row['is_read'])
+        adjust_unread_counts({user_id: -count for user_id, count in unread.items()})
+        archived += len(rows)
+    return archived
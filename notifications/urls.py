@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import NotificationViewSet, FCMDeviceViewSet, SystemNotificationView
+from .views import NotificationViewSet, FCMDeviceViewSet, SystemNotificationView, BroadcastJobView
 
 router = DefaultRouter()
 router.register(r'devices', FCMDeviceViewSet, basename='fcmdevice')
@@ -8,5 +8,6 @@ router.register(r'', NotificationViewSet, basename='notification')
 
 urlpatterns = [
     path('system/', SystemNotificationView.as_view(), name='system-notification'),
+    path('system/<uuid:pk>/', BroadcastJobView.as_view(), name='system-notification-job'),
     path('', include(router.urls)),
 ]
@@ -1,12 +1,22 @@
 import os
+import asyncio
 import logging
 import firebase_admin
-from firebase_admin import credentials, messaging
+from firebase_admin import credentials
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.conf import settings
+from accounts.models import CustomUser
+from .backends import get_push_backend
+from .cache import adjust_unread_counts, bury_tokens, get_device_tokens, live_tokens, online_user_ids
 from .models import FCMDevice, Notification
+from .serializers import NotificationSerializer
 
 logger = logging.getLogger(__name__)
 
+# Firebase rejects multicasts with more tokens than this
+FCM_MULTICAST_LIMIT = 500
+
 # Firebase initialization
 firebase_creds_path = os.path.join(settings.BASE_DIR, 'ws-notification-4dcca-firebase-adminsdk-fbsvc-9b52b22c40.json')
 
@@ -25,12 +35,88 @@ def initialize_firebase():
 # Initialize at module level
 initialize_firebase()
 
+def build_push_data(notification_type, data=None):
+    message_data = {
+        'type': notification_type,
+    }
+    if data:
+        for k, v in data.items():
+            message_data[k] = str(v)
+    return message_data
+
+
+def send_push(tokens, title, body, notification_type, data=None):
+    """
+    Sends one notification to any number of device tokens, FCM_MULTICAST_LIMIT
+    tokens per multicast, and prunes tokens Firebase reports as no longer
+    registered.
+    """
+    backend = get_push_backend()
+    if not backend.is_available():
+        logger.warning("Firebase not initialized. Skipping push notification.")
+        return 0
+    tokens = live_tokens(tokens)
+    if not tokens:
+        return 0
+
+    message_data = build_push_data(notification_type, data)
+    sent, invalid_tokens = 0, []
+    for i in range(0, len(tokens), FCM_MULTICAST_LIMIT):
+        batch = tokens[i:i + FCM_MULTICAST_LIMIT]
+        try:
+            success_count, failed = backend.send_multicast(batch, title, body, message_data)
+        except Exception as e:
+            logger.error(f"Error sending notification: {e}")
+            continue
+        sent += success_count
+        invalid_tokens.extend(failed)
+
+    logger.info(f"[FCM] Successfully sent {sent}/{len(tokens)} notifications")
+    if invalid_tokens:
+        bury_tokens(invalid_tokens)
+        FCMDevice.objects.filter(registration_token__in=invalid_tokens).delete()
+        logger.info(f"Deleted {len(invalid_tokens)} invalid tokens")
+    return sent
+
+
+async def _group_send_all(messages):
+    channel_layer = get_channel_layer()
+    await asyncio.gather(*(channel_layer.group_send(group, message) for group, message in messages))
+
+
+def _attach_senders(notifications):
+    # Rows built from sender_id alone would each fetch their sender while serializing
+    missing = {n.sender_id for n in notifications if n.sender_id and not Notification.sender.is_cached(n)}
+    if not missing:
+        return
+    senders = CustomUser.objects.in_bulk(missing)
+    for notification in notifications:
+        if notification.sender_id in senders and not Notification.sender.is_cached(notification):
+            notification.sender = senders[notification.sender_id]
+
+
+def publish_in_band(notifications):
+    """
+    Delivers notifications over the WebSocket to recipients that are online
+    and returns their ids; those recipients skip the FCM push.
+    """
+    online = online_user_ids({n.recipient_id for n in notifications})
+    if online:
+        in_band = [n for n in notifications if n.recipient_id in online]
+        _attach_senders(in_band)
+        async_to_sync(_group_send_all)([
+            (f"user.{n.recipient_id}", {"type": "notification.new", "notification": NotificationSerializer(n).data})
+            for n in in_band
+        ])
+    return online
+
+
 def send_fcm_notification(user, title, body, notification_type, sender=None, data=None):
     """
     Sends a push notification to all devices registered for a user and saves to Notification history.
     """
     # 1. Save to database history
-    Notification.objects.create(
+    notification = Notification.objects.create(
         recipient=user,
         sender=sender,
         notification_type=notification_type,
@@ -38,56 +124,14 @@ def send_fcm_notification(user, title, body, notification_type, sender=None, dat
         body=body,
         data=data or {}
     )
+    adjust_unread_counts({user.id: 1})
 
-    # 2. Check if Firebase is initialized
-    if not firebase_admin._apps:
-        logger.warning("Firebase not initialized. Skipping push notification.")
-        return
-
-    # 3. Get devices
-    devices = FCMDevice.objects.filter(user=user)
-    if not devices.exists():
+    # 2. Online users get it over their open socket
+    if publish_in_band([notification]):
         return
 
-    tokens = list(devices.values_list('registration_token', flat=True))
-    
-    # 4. Prepare message
-    message_data = {
-        'type': notification_type,
-    }
-    if data:
-        for k, v in data.items():
-            message_data[k] = str(v)
-
-    # 5. Send multicast message
-    message = messaging.MulticastMessage(
-        notification=messaging.Notification(
-            title=title,
-            body=body,
-        ),
-        data=message_data,
-        tokens=tokens,
-    )
-
-    try:
-        response = messaging.send_each_for_multicast(message)
-        logger.info(f"Successfully sent {response.success_count} notifications for user {user.id}")
-        print(f"[FCM] Successfully sent {response.success_count}/{len(tokens)} notifications for user {user.id}")
-        
-        # Cleanup invalid tokens
-        if response.failure_count > 0:
-            invalid_tokens = []
-            for idx, resp in enumerate(response.responses):
-                if not resp.success:
-                    logger.warning(f"[FCM] Failed to send to token {idx}: {resp.exception}")
-                    print(f"[FCM] Failed to send to token {idx}: {resp.exception}")
-                    invalid_tokens.append(tokens[idx])
-            
-            if invalid_tokens:
-                FCMDevice.objects.filter(registration_token__in=invalid_tokens).delete()
-                logger.info(f"Deleted {len(invalid_tokens)} invalid tokens")
-                print(f"[FCM] Deleted {len(invalid_tokens)} invalid tokens")
-                
-    except Exception as e:
-        logger.error(f"Error sending notification: {e}")
-        print(f"[FCM] ERROR: {e}")
+    # 3. Send to every registered device
+    tokens = get_device_tokens([user.id])[user.id]
+    sent = send_push(tokens, title, body, notification_type, data)
+    if sent:
+        logger.info(f"Successfully sent {sent} notifications for user {user.id}")
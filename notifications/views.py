@@ -1,19 +1,21 @@
+from django.db import transaction
+from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from accounts.models import CustomUser
-from utils.pagination import StandardResultsSetPagination
-from .models import Notification, FCMDevice
-from .serializers import NotificationSerializer, FCMDeviceSerializer, SystemNotificationSerializer
-from .utils import send_fcm_notification
+from utils.pagination import KeysetPagination
+from .cache import adjust_unread_counts, get_unread_count
+from .models import BroadcastJob, Notification, FCMDevice
+from .serializers import BroadcastJobSerializer, NotificationSerializer, FCMDeviceSerializer, SystemNotificationSerializer
+from .tasks import run_broadcast_job
 
 
 class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return Notification.objects.filter(recipient=self.request.user).select_related('sender')
@@ -21,19 +23,19 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['post'])
     def read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save(update_fields=['is_read'])
+        updated = self.get_queryset().filter(pk=notification.pk, is_read=False).update(is_read=True)
+        adjust_unread_counts({request.user.id: -updated})
         return Response({'status': 'notification marked as read'})
 
     @action(detail=False, methods=['post'])
     def read_all(self, request):
-        self.get_queryset().filter(is_read=False).update(is_read=True)
+        updated = self.get_queryset().filter(is_read=False).update(is_read=True)
+        adjust_unread_counts({request.user.id: -updated})
         return Response({'status': 'all notifications marked as read'})
 
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
-        count = self.get_queryset().filter(is_read=False).count()
-        return Response({'unread_count': count})
+        return Response({'unread_count': get_unread_count(request.user.id)})
 
 
 class FCMDeviceViewSet(viewsets.ModelViewSet):
@@ -51,7 +53,7 @@ class FCMDeviceViewSet(viewsets.ModelViewSet):
 class SystemNotificationView(APIView):
     """
     Admin uchun system notification yaratish API.
-    POST: barcha yoki tanlangan userlarga notification yuboradi.
+    POST: barcha yoki tanlangan userlarga notification yuborish uchun fon vazifasini yaratadi.
     """
     permission_classes = [permissions.IsAuthenticated]
 
@@ -65,29 +67,29 @@ class SystemNotificationView(APIView):
         serializer = SystemNotificationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        title = serializer.validated_data['title']
-        body = serializer.validated_data['body']
-        user_ids = serializer.validated_data.get('user_ids', [])
-
-        if user_ids:
-            recipients = CustomUser.objects.filter(id__in=user_ids, is_active=True)
-        else:
-            recipients = CustomUser.objects.filter(is_active=True)
-
-        sent_count = 0
-        for user in recipients:
-            send_fcm_notification(
-                user=user,
-                title=title,
-                body=body,
-                notification_type='system',
-                sender=request.user,
-                data={'type': 'system'}
+        job = BroadcastJob.objects.create(
+            created_by=request.user,
+            title=serializer.validated_data['title'],
+            body=serializer.validated_data['body'],
+            user_ids=serializer.validated_data.get('user_ids', []),
+        )
+        transaction.on_commit(lambda: run_broadcast_job.delay(str(job.id)))
+
+        return Response(BroadcastJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class BroadcastJobView(APIView):
+    """
+    System broadcast holati: nechta userga yuborilgani va jarayon foizi.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        if not request.user.is_staff:
+            return Response(
+                {'error': "Sizda bu amalni bajarish uchun ruxsat yo'q."},
+                status=status.HTTP_403_FORBIDDEN
             )
-            sent_count += 1
 
-        return Response({
-            'status': 'success',
-            'sent_count': sent_count,
-            'title': title,
-        }, status=status.HTTP_201_CREATED)
+        job = get_object_or_404(BroadcastJob, pk=pk)
+        return Response(BroadcastJobSerializer(job).data)
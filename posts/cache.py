@@ -0,0 +1,29 @@
+import json
+
+import redis
+
+redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+
+# First page of a post's likers / commenters / viewers, the page almost every
+# client asks for. Dropped whenever that list changes.
+FIRST_PAGE_TTL = 5 * 60
+INTERACTION_KINDS = ("likes", "comments", "views")
+
+
+def _first_page_key(kind, post_id):
+    return f"post_{kind}_page:{post_id}"
+
+
+def get_first_page(kind, post_id):
+    cached = redis_client.get(_first_page_key(kind, post_id))
+    return json.loads(cached) if cached is not None else None
+
+
+def set_first_page(kind, post_id, data):
+    redis_client.set(_first_page_key(kind, post_id), json.dumps(data), ex=FIRST_PAGE_TTL)
+
+
+def invalidate_first_pages(post_ids, *kinds):
+    keys = [_first_page_key(kind, post_id) for post_id in post_ids for kind in kinds or INTERACTION_KINDS]
+    if keys:
+        redis_client.delete(*keys)
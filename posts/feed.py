@@ -0,0 +1,129 @@
+import redis
+
+from accounts.models import Contact
+from .models import Post
+
+redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+
+# Home timelines: timeline:{user_id} is a sorted set of post ids scored by
+# created_at. Posts are pushed at write time to the author's followers (users
+# holding the author in their contacts); authors with more followers than
+# FANOUT_MAX_FOLLOWERS are only merged in at read time.
+TIMELINE_SIZE = 800
+TIMELINE_TTL = 7 * 24 * 60 * 60
+FANOUT_MAX_FOLLOWERS = 5000
+FANOUT_BATCH = 1000
+CELEBRITIES_KEY = "feed:celebrities"
+# A rebuild that finds nothing leaves this marker so an empty timeline is not
+# rebuilt from the DB on every request; a fan-out push clears it so the next
+# read rebuilds with the new post
+EMPTY_TIMELINE_TTL = 5 * 60
+
+# Only timelines that are already built take the push: a cold one holding just
+# the new post would look warm and hide the history _rebuild_timeline loads
+_PUSH_IF_BUILT = """
+redis.call('DEL', KEYS[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+def _timeline_key(user_id):
+    return f"timeline:{user_id}"
+
+
+def _empty_key(user_id):
+    return f"timeline_empty:{user_id}"
+
+
+def follower_ids(author_id):
+    return Contact.objects.filter(contact_id=author_id).values_list('owner_id', flat=True)
+
+
+def _push(user_ids, post_id, score):
+    pipeline = redis_client.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipeline.eval(
+            _PUSH_IF_BUILT, 2, _timeline_key(user_id), _empty_key(user_id),
+            str(post_id), score, TIMELINE_SIZE, TIMELINE_TTL
+        )
+    pipeline.execute()
+
+
+def fan_out(post):
+    """Pushes a new post into the timelines of its author and followers."""
+    score = post.created_at.timestamp()
+    _push([post.owner_id], post.pk, score)
+
+    if follower_ids(post.owner_id).count() > FANOUT_MAX_FOLLOWERS:
+        redis_client.sadd(CELEBRITIES_KEY, post.owner_id)
+        return 0
+    redis_client.srem(CELEBRITIES_KEY, post.owner_id)
+
+    pushed, last_id = 0, 0
+    while True:
+        batch = list(follower_ids(post.owner_id).filter(owner_id__gt=last_id).order_by('owner_id')[:FANOUT_BATCH])
+        if not batch:
+            return pushed
+        _push(batch, post.pk, score)
+        pushed += len(batch)
+        last_id = batch[-1]
+
+
+def _feed_posts():
+    return Post.objects.filter(is_active=True).order_by('-created_at', '-pk')
+
+
+def _rebuild_timeline(user_id):
+    """Fan-out-on-read for a cold timeline: the newest posts of everyone followed."""
+    followed = list(Contact.objects.filter(owner_id=user_id).values_list('contact_id', flat=True))
+    rows = _feed_posts().filter(owner_id__in=followed + [user_id]).values_list('pk', 'created_at')[:TIMELINE_SIZE]
+    key = _timeline_key(user_id)
+    pipeline = redis_client.pipeline()
+    pipeline.delete(key)
+    if rows:
+        pipeline.zadd(key, {pk: created_at.timestamp() for pk, created_at in rows})
+        pipeline.expire(key, TIMELINE_TTL)
+    else:
+        pipeline.set(_empty_key(user_id), 1, ex=EMPTY_TIMELINE_TTL)
+    pipeline.execute()
+
+
+def feed_page(user_id, limit, before=None):
+    """
+    (score, post id) pairs for the next `limit` posts of the user's home
+    feed, newest first, strictly older than the (created_at, pk) `before`
+    cursor. Returns `limit + 1` entries at most so callers can tell if more
+    exist.
+    """
+    key = _timeline_key(user_id)
+    if not redis_client.exists(key, _empty_key(user_id)):
+        _rebuild_timeline(user_id)
+
+    max_score = before[0].timestamp() if before else "+inf"
+    # Inclusive bound plus slack: posts sharing the cursor's timestamp are
+    # filtered on pk below
+    entries = redis_client.zrevrangebyscore(key, max_score, "-inf", start=0, num=limit + 10, withscores=True)
+    candidates = [(score, pk) for pk, score in entries]
+
+    celebrities = redis_client.smembers(CELEBRITIES_KEY)
+    if celebrities:
+        followed = Contact.objects.filter(owner_id=user_id, contact_id__in=celebrities).values_list('contact_id', flat=True)
+        posts = _feed_posts().filter(owner_id__in=followed)
+        if before:
+            posts = posts.filter(created_at__lte=before[0])
+        candidates.extend(
+            (created_at.timestamp(), pk)
+            for pk, created_at in posts.values_list('pk', 'created_at')[:limit + 10]
+        )
+
+    candidates = sorted(set(candidates), reverse=True)
+    if before:
+        cursor = (before[0].timestamp(), before[1])
+        candidates = [c for c in candidates if c < cursor]
+    return candidates[:limit + 1]
@@ -0,0 +1,104 @@
+from collections import Counter, defaultdict
+
+import redis
+from django.db import transaction
+from django.db.models import F
+
+from accounts.models import CustomUser
+from .cache import invalidate_first_pages
+from .models import Post, PostViews
+
+redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
+
+# Impressions are deduplicated per post in post_viewers:{post_id} and queued
+# as "post_id|user_id" in PENDING_VIEWS_KEY until flush_post_views writes them.
+VIEWERS_TTL = 7 * 24 * 60 * 60
+PENDING_VIEWS_KEY = "post_views:pending"
+PROCESSING_VIEWS_KEY = "post_views:processing"
+FLUSH_BATCH = 5000
+
+# Moves the next batch from the pending set into the processing set, unless a
+# flush that died mid-write left one there, which is handed out again first
+_CLAIM_BATCH = """
+local claimed = redis.call('SRANDMEMBER', KEYS[2], ARGV[1])
+if #claimed > 0 then
+    return claimed
+end
+claimed = redis.call('SPOP', KEYS[1], ARGV[1])
+for i = 1, #claimed, 1000 do
+    redis.call('SADD', KEYS[2], unpack(claimed, i, math.min(i + 999, #claimed)))
+end
+return claimed
+"""
+
+
+def _viewers_key(post_id):
+    return f"post_viewers:{post_id}"
+
+
+def record_views(user_id, post_ids):
+    """Queues first-time views of `post_ids` by the user; returns how many were new."""
+    post_ids = list(dict.fromkeys(str(post_id) for post_id in post_ids))
+    pipeline = redis_client.pipeline(transaction=False)
+    for post_id in post_ids:
+        pipeline.sadd(_viewers_key(post_id), user_id)
+        pipeline.expire(_viewers_key(post_id), VIEWERS_TTL)
+    added = pipeline.execute()[::2]
+
+    new_views = [f"{post_id}|{user_id}" for post_id, is_new in zip(post_ids, added) if is_new]
+    if new_views:
+        redis_client.sadd(PENDING_VIEWS_KEY, *new_views)
+    return len(new_views)
+
+
+def _claim_batch(batch_size):
+    return redis_client.eval(_CLAIM_BATCH, 2, PENDING_VIEWS_KEY, PROCESSING_VIEWS_KEY, batch_size)
+
+
+def flush_views(batch_size=FLUSH_BATCH):
+    """
+    Writes one batch of queued views with a conflict-ignoring bulk insert and
+    bumps view_count by the rows actually inserted. The batch stays in
+    PROCESSING_VIEWS_KEY until the transaction commits, so a crashed flush is
+    picked up again by the next one. Returns the batch size.
+    """
+    claimed = _claim_batch(batch_size)
+    if not claimed:
+        return 0
+
+    pairs = set()
+    for entry in claimed:
+        post_id, _, user_id = entry.partition("|")
+        if user_id.isdigit():
+            pairs.add((post_id, int(user_id)))
+
+    inserted = Counter()
+    if pairs:
+        with transaction.atomic():
+            post_ids = set(Post.objects.filter(pk__in={post_id for post_id, _ in pairs}).values_list('pk', flat=True))
+            user_ids = set(CustomUser.objects.filter(pk__in={user_id for _, user_id in pairs}).values_list('pk', flat=True))
+            rows = [
+                PostViews(post_id=post_id, owner_id=user_id)
+                for post_id, user_id in pairs if post_id in post_ids and user_id in user_ids
+            ]
+            PostViews.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+            # Ids are generated client-side, so the ones that exist now are
+            # exactly the rows this insert wrote; replays and views already
+            # saved through the API add nothing
+            for chunk in range(0, len(rows), 1000):
+                inserted.update(PostViews.objects.filter(
+                    pk__in=[row.pk for row in rows[chunk:chunk + 1000]]
+                ).values_list('post_id', flat=True))
+
+            by_count = defaultdict(list)
+            for post_id, count in inserted.items():
+                by_count[count].append(post_id)
+            for count, ids in by_count.items():
+                Post.objects.filter(pk__in=ids).update(view_count=F('view_count') + count)
+
+    for chunk in range(0, len(claimed), 1000):
+        redis_client.srem(PROCESSING_VIEWS_KEY, *claimed[chunk:chunk + 1000])
+    if inserted:
+        invalidate_first_pages(inserted, 'views')
+    return len(claimed)
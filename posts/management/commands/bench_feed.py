@@ -0,0 +1,83 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import Contact, CustomUser
+from posts.feed import _rebuild_timeline, _timeline_key, feed_page, redis_client
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Home feed latency from the Redis timeline vs a SQL scan at growing post counts (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--authors", type=int, default=500)
+        parser.add_argument("--followed", type=int, default=100)
+        parser.add_argument("--runs", type=int, default=50)
+        parser.add_argument("--limit", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            reader, authors = self._seed_users(options["authors"])
+            followed = [author.id for author in authors[:options["followed"]]]
+            Contact.objects.bulk_create([Contact(owner=reader, contact_id=author_id) for author_id in followed])
+
+            seeded = 0
+            try:
+                for size in sorted(options["sizes"]):
+                    self._seed_posts(authors, seeded, size)
+                    seeded = size
+                    _rebuild_timeline(reader.id)
+
+                    timeline = self._time(options["runs"], lambda: self._timeline_page(reader, options["limit"]))
+                    scan = self._time(options["runs"], lambda: self._scan_page(followed, options["limit"]))
+                    self.stdout.write(
+                        f"{size:>9} posts  timeline p50 {timeline[0]:7.2f} ms  p99 {timeline[1]:7.2f} ms"
+                        f"  |  sql scan p50 {scan[0]:7.2f} ms  p99 {scan[1]:7.2f} ms"
+                    )
+            finally:
+                redis_client.delete(_timeline_key(reader.id))
+                transaction.set_rollback(True)
+
+    def _seed_users(self, count):
+        suffix = uuid.uuid4().hex[:8]
+        users = CustomUser.objects.bulk_create([
+            CustomUser(email=f"feed-{i}-{suffix}@example.com", username=f"feed_{i}_{suffix}")
+            for i in range(count + 1)
+        ])
+        return users[0], users[1:]
+
+    def _seed_posts(self, authors, start, end, batch_size=5000):
+        for offset in range(start, end, batch_size):
+            Post.objects.bulk_create([
+                Post(
+                    id=str(uuid.uuid4()),
+                    owner=authors[i % len(authors)],
+                    content=f"post {i}",
+                )
+                for i in range(offset, min(offset + batch_size, end))
+            ], batch_size=batch_size)
+
+    def _time(self, runs, fn):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+    def _timeline_page(self, reader, limit):
+        entries = feed_page(reader.id, limit)
+        return list(Post.objects.filter(pk__in=[pk for _, pk in entries[:limit]]).select_related("owner"))
+
+    def _scan_page(self, followed, limit):
+        return list(
+            Post.objects
+            .filter(owner_id__in=followed, is_active=True)
+            .select_related("owner")
+            .order_by("-created_at")[:limit]
+        )
@@ -0,0 +1,77 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIClient, APIRequestFactory
+
+from accounts.models import CustomUser
+from posts.cache import invalidate_first_pages
+from posts.models import Post, PostLikes
+from posts.serializers import PostLikeSerializer
+
+
+class Command(BaseCommand):
+    help = "p50/p99 of a post's likers list: full unpaginated dump vs keyset pages, cold and cached (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interactions", type=int, default=100_000)
+        parser.add_argument("--runs", type=int, default=30)
+
+    def handle(self, *args, **options):
+        runs = options["runs"]
+        with transaction.atomic():
+            viewer, post = self._seed(options["interactions"])
+            client = APIClient()
+            client.force_authenticate(viewer)
+            url = f"/api/posts/{post.pk}/likes/"
+
+            try:
+                request = APIRequestFactory().get(url)
+
+                def unpaginated():
+                    likes = PostLikes.objects.filter(post_id=post.pk).select_related('owner')
+                    return PostLikeSerializer(likes, many=True, context={'request': request}).data
+
+                def cold_first_page():
+                    invalidate_first_pages([post.pk], 'likes')
+                    return client.get(url)
+
+                deep_cursor = client.get(url, {"limit": 100}).data["next"]
+                for _ in range(min(20, options["interactions"] // 100)):
+                    deep_cursor = client.get(deep_cursor).data["next"] or deep_cursor
+
+                results = [
+                    ("unpaginated (old)", self._time(max(3, runs // 10), unpaginated)),
+                    ("first page, cold", self._time(runs, cold_first_page)),
+                    ("first page, cached", self._time(runs, lambda: client.get(url))),
+                    ("deep cursor page", self._time(runs, lambda: client.get(deep_cursor))),
+                ]
+            finally:
+                invalidate_first_pages([post.pk], 'likes')
+                transaction.set_rollback(True)
+
+        self.stdout.write(f"{options['interactions']} likes on one post")
+        for label, (p50, p99) in results:
+            self.stdout.write(f"{label:<20} p50 {p50:9.2f} ms  p99 {p99:9.2f} ms")
+
+    def _seed(self, count, batch_size=5000):
+        suffix = uuid.uuid4().hex[:8]
+        author = CustomUser.objects.create_user(email=f"likes-author-{suffix}@example.com", username=f"likes_a_{suffix}")
+        post = Post.objects.create(owner=author, content="benchmark")
+        for offset in range(0, count, batch_size):
+            users = CustomUser.objects.bulk_create([
+                CustomUser(email=f"likes-{i}-{suffix}@example.com", username=f"likes_{i}_{suffix}", first_name="Bench")
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+            PostLikes.objects.bulk_create([PostLikes(id=str(uuid.uuid4()), owner=user, post=post) for user in users])
+        return author, post
+
+    def _time(self, runs, fn):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post, recount_post_counters
+
+
+class Command(BaseCommand):
+    help = "Recomputes like/comment/view counters on Post from the interaction tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("post_ids", nargs="*", help="Only these posts (default: all)")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.order_by("pk")
+        if options["post_ids"]:
+            queryset = queryset.filter(pk__in=options["post_ids"])
+
+        # Keyset batches keep each UPDATE's lock footprint small
+        batch_size = options["batch_size"]
+        updated, last_pk = 0, None
+        while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            pks = list(batch.values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            updated += recount_post_counters(Post.objects.filter(pk__in=pks))
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Recounted {updated} posts"))
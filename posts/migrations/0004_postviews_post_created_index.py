@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='postviews',
+            index=models.Index(fields=['post', '-created_at'], name='posts_postv_post_id_e25ea3_idx'),
+        ),
+    ]
@@ -1,4 +1,7 @@
 from django.db import models
+from django.contrib.contenttypes.fields import GenericRelation
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from uuid import uuid4
 
 from accounts.models import CustomUser
@@ -11,6 +14,10 @@ class Post(models.Model):
     content = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
     is_edited = models.BooleanField(default=False)
+    # Denormalized from PostLikes / PostComment / PostViews by posts.signals
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    view_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(blank=True, null=True)
 
@@ -32,6 +39,7 @@ class PostImages(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="images")
     image = models.FileField(upload_to="posts/images/")
     created_at = models.DateTimeField(auto_now=True)
+    variants = GenericRelation("previews.MediaVariant")
 
     def __str__(self):
         return self.id
@@ -49,6 +57,7 @@ class PostViews(models.Model):
         unique_together = ('post', 'owner')
         indexes = [
             models.Index(fields=['post', 'owner']),
+            models.Index(fields=['post', '-created_at']),
         ]
 
     def __str__(self):
@@ -94,3 +103,18 @@ class PostComment(models.Model):
 
     def __str__(self):
         return self.id
+
+
+def recount_post_counters(queryset=None):
+    """Recomputes the denormalized counters from the interaction tables."""
+    def count(model):
+        return Coalesce(Subquery(
+            model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(c=Count('id')).values('c')
+        ), 0)
+
+    queryset = Post.objects.all() if queryset is None else queryset
+    return queryset.update(
+        like_count=count(PostLikes),
+        comment_count=count(PostComment),
+        view_count=count(PostViews),
+    )
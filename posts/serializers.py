@@ -1,22 +1,51 @@
 from rest_framework import serializers
+from django.db import transaction
 from django.utils import timezone
 
 from accounts.serializers import UserMiniSerializer
+from previews.serializers import MediaVariantsField
+from previews.tasks import generate_variants
 from .models import Post, PostImages, PostLikes, PostComment, PostViews
 
 
 # Post Image Serializer
 class PostImageSerializer(serializers.ModelSerializer):
+    variants = MediaVariantsField()
+
     class Meta:
         model = PostImages
-        fields = ['id', 'image', 'created_at']
+        fields = ['id', 'image', 'variants', 'created_at']
         read_only_fields = ['id', 'created_at']
 
 
+class OwnerRepresentationMixin:
+    """
+    Flat owner dict for interaction lists. The absolute media prefix is
+    resolved once and shared through the root serializer's context.
+    """
+    def get_owner(self, instance):
+        owner = instance.owner
+        return {
+            "id": owner.id,
+            "username": owner.username,
+            "full_name": owner.get_full_name(),
+            "profile_picture": self._absolute_url(owner.profile_picture.url) if owner.profile_picture else None
+        }
+
+    def _absolute_url(self, url):
+        if "://" in url:
+            return url
+        request = self.context.get('request')
+        if not request:
+            return url
+        base = self.context.setdefault('absolute_base', request.build_absolute_uri('/').rstrip('/'))
+        return base + url
+
+
 # Post Like Serializer
-class PostLikeSerializer(serializers.ModelSerializer):
+class PostLikeSerializer(OwnerRepresentationMixin, serializers.ModelSerializer):
     post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all())
-    owner = UserMiniSerializer(read_only=True)
+    owner = serializers.SerializerMethodField()
 
     class Meta:
         model = PostLikes
@@ -32,17 +61,6 @@ class PostLikeSerializer(serializers.ModelSerializer):
         
         return attrs
 
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        representation = super().to_representation(instance)
-        representation['owner'] = {
-            "id": instance.owner.id,
-            "username": instance.owner.username,
-            "full_name": instance.owner.get_full_name(),
-            "profile_picture": request.build_absolute_uri(instance.owner.profile_picture.url) if instance.owner.profile_picture else None
-        }
-        return representation
-
     def create(self, validated_data):
         request = self.context['request']
         post_like = PostLikes.objects.create(owner=request.user, **validated_data)
@@ -50,8 +68,8 @@ class PostLikeSerializer(serializers.ModelSerializer):
 
 
 # Post Comment Serializer
-class PostCommentSerializer(serializers.ModelSerializer):
-    owner = UserMiniSerializer(read_only=True)
+class PostCommentSerializer(OwnerRepresentationMixin, serializers.ModelSerializer):
+    owner = serializers.SerializerMethodField()
     post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all())
 
     class Meta:
@@ -59,17 +77,6 @@ class PostCommentSerializer(serializers.ModelSerializer):
         fields = ['id', 'owner', 'post', 'comment', 'reply_to', 'is_edited', 'created_at', 'updated_at']
         read_only_fields = ['id', 'is_edited', 'created_at', 'updated_at']
 
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        representation = super().to_representation(instance)
-        representation['owner'] = {
-            "id": instance.owner.id,
-            "username": instance.owner.username,
-            "full_name": instance.owner.get_full_name(),
-            "profile_picture": request.build_absolute_uri(instance.owner.profile_picture.url) if instance.owner.profile_picture else None
-        }
-        return representation
-
     def update(self, instance, validated_data):
         instance.comment = validated_data.get('comment', instance.comment)
         instance.is_edited = True
@@ -84,8 +91,8 @@ class PostCommentSerializer(serializers.ModelSerializer):
 
 
 # Post View Serializer
-class PostViewSerializer(serializers.ModelSerializer):
-    owner = UserMiniSerializer(read_only=True)
+class PostViewSerializer(OwnerRepresentationMixin, serializers.ModelSerializer):
+    owner = serializers.SerializerMethodField()
     post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all())
 
     class Meta:
@@ -100,23 +107,21 @@ class PostViewSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("You have already viewed this post.")
         return attrs
 
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        representation = super().to_representation(instance)
-        representation['owner'] = {
-            "id": instance.owner.id,
-            "username": instance.owner.username,
-            "full_name": instance.owner.get_full_name(),
-            "profile_picture": request.build_absolute_uri(instance.owner.profile_picture.url) if instance.owner.profile_picture else None
-        }
-        return representation
-
     def create(self, validated_data):
         request = self.context['request']
         post_view = PostViews.objects.create(owner=request.user, **validated_data)
         return post_view
 
 
+# Post View batch Serializer
+class PostViewBatchSerializer(serializers.Serializer):
+    post_ids = serializers.ListField(
+        child=serializers.CharField(max_length=128),
+        allow_empty=False,
+        max_length=100
+    )
+
+
 # Post Serializer
 class PostSerializer(serializers.ModelSerializer):
     images = PostImageSerializer(many=True, required=False)
@@ -130,7 +135,7 @@ class PostSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
         fields = ['id', 'content', 'owner', 'images', 'is_active', 'is_edited', 'like_count', 'comment_count', 'view_count', 'is_liked', 'is_read', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'owner', 'is_active', 'is_edited', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'owner', 'is_active', 'is_edited', 'like_count', 'comment_count', 'view_count', 'created_at', 'updated_at']
 
     def create(self, validated_data):
         request = self.context['request']
@@ -144,6 +149,9 @@ class PostSerializer(serializers.ModelSerializer):
         ]
 
         PostImages.objects.bulk_create(images)
+        # bulk_create sends no post_save, so previews.signals never sees these
+        for image in images:
+            transaction.on_commit(lambda object_id=str(image.pk): generate_variants.delay("posts.PostImages", object_id))
         return post
 
 
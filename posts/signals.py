@@ -1,8 +1,13 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import PostLikes, PostComment
+from .models import Post, PostLikes, PostComment, PostViews
 from notifications.utils import send_fcm_notification
 from notifications.constants import LIKE_TITLE, LIKE_BODY, COMMENT_TITLE, COMMENT_BODY, REPLY_TITLE, REPLY_BODY
+from .cache import invalidate_first_pages
+from .tasks import fan_out_post
 
 @receiver(post_save, sender=PostLikes)
 def notify_post_like(sender, instance, created, **kwargs):
@@ -61,3 +66,55 @@ def notify_post_comment(sender, instance, created, **kwargs):
                     sender=sender_user,
                     data={'post_id': str(post.id), 'comment_id': str(instance.id)}
                 )
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        post_id = str(instance.pk)
+        transaction.on_commit(lambda: fan_out_post.delay(post_id))
+
+
+CACHE_KINDS = {
+    PostLikes: 'likes',
+    PostComment: 'comments',
+    PostViews: 'views',
+}
+
+
+@receiver(post_save, sender=PostLikes)
+@receiver(post_save, sender=PostComment)
+@receiver(post_save, sender=PostViews)
+@receiver(post_delete, sender=PostLikes)
+@receiver(post_delete, sender=PostComment)
+@receiver(post_delete, sender=PostViews)
+def invalidate_interaction_page(sender, instance, **kwargs):
+    post_id = instance.post_id
+    transaction.on_commit(lambda: invalidate_first_pages([post_id], CACHE_KINDS[sender]))
+
+
+COUNTER_FIELDS = {
+    PostLikes: 'like_count',
+    PostComment: 'comment_count',
+    PostViews: 'view_count',
+}
+
+
+def _bump_counter(model, post_id, delta):
+    field = COUNTER_FIELDS[model]
+    Post.objects.filter(pk=post_id).update(**{field: Greatest(F(field) + delta, 0)})
+
+
+@receiver(post_save, sender=PostLikes)
+@receiver(post_save, sender=PostComment)
+@receiver(post_save, sender=PostViews)
+def increment_post_counter(sender, instance, created, **kwargs):
+    if created:
+        _bump_counter(sender, instance.post_id, 1)
+
+
+@receiver(post_delete, sender=PostLikes)
+@receiver(post_delete, sender=PostComment)
+@receiver(post_delete, sender=PostViews)
+def decrement_post_counter(sender, instance, **kwargs):
+    _bump_counter(sender, instance.post_id, -1)
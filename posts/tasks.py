@@ -0,0 +1,23 @@
+from celery import shared_task
+
+from .feed import fan_out
+from .impressions import flush_views
+from .models import Post
+
+
+@shared_task
+def fan_out_post(post_id):
+    post = Post.objects.filter(pk=post_id, is_active=True).first()
+    if post:
+        return fan_out(post)
+
+
+@shared_task
+def flush_post_views(max_batches=20):
+    flushed = 0
+    for _ in range(max_batches):
+        count = flush_views()
+        flushed += count
+        if not count:
+            break
+    return flushed
@@ -1,3 +1,84 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from accounts.models import Contact, CustomUser
+from .feed import CELEBRITIES_KEY, _empty_key, _timeline_key, fan_out, redis_client
+from .models import Post, PostImages
+
+
+class FeedTimelineTests(TestCase):
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(email="author@example.com", username="feed_author")
+        self.reader = CustomUser.objects.create_user(email="reader@example.com", username="feed_reader")
+        Contact.objects.create(owner=self.reader, contact=self.author)
+        for i in range(5):
+            Post.objects.create(owner=self.author, content=f"old {i}")
+
+        self.keys = [
+            key for user in (self.author, self.reader) for key in (_timeline_key(user.id), _empty_key(user.id))
+        ]
+        redis_client.delete(*self.keys)
+        redis_client.srem(CELEBRITIES_KEY, self.author.id)
+        self.addCleanup(redis_client.delete, *self.keys)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def feed_contents(self):
+        response = self.client.get(reverse("post-feed"), {"limit": 20})
+        self.assertEqual(response.status_code, 200)
+        return [post["content"] for post in response.data["results"]]
+
+    def test_fan_out_to_cold_timeline_keeps_history(self):
+        fan_out(Post.objects.create(owner=self.author, content="new"))
+
+        contents = self.feed_contents()
+        self.assertEqual(len(contents), 6)
+        self.assertEqual(contents[0], "new")
+
+    def test_fan_out_to_warm_timeline(self):
+        self.assertEqual(len(self.feed_contents()), 5)
+        fan_out(Post.objects.create(owner=self.author, content="new"))
+
+        contents = self.feed_contents()
+        self.assertEqual(len(contents), 6)
+        self.assertEqual(contents[0], "new")
+
+    def test_fan_out_clears_empty_marker(self):
+        Post.objects.filter(owner=self.author).update(is_active=False)
+        self.assertEqual(self.feed_contents(), [])
+        self.assertTrue(redis_client.exists(_empty_key(self.reader.id)))
+
+        fan_out(Post.objects.create(owner=self.author, content="new"))
+        self.assertEqual(self.feed_contents(), ["new"])
+
+
+class PostImageVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_creating_post_images_queues_variants(self):
+        owner = CustomUser.objects.create_user(email="images@example.com", username="images_owner")
+        client = APIClient()
+        client.force_authenticate(owner)
+        images = [SimpleUploadedFile(f"{i}.png", b"png", content_type="image/png") for i in range(2)]
+
+        with mock.patch("previews.tasks.generate_variants.delay") as queued, \
+                mock.patch("posts.tasks.fan_out_post.delay"), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse("post-list"), {"content": "pictures", "images": images}, format="multipart")
+
+        self.assertEqual(response.status_code, 201, response.content)
+        image_ids = PostImages.objects.filter(post__owner=owner).values_list("pk", flat=True)
+        self.assertEqual(len(image_ids), 2)
+        self.assertCountEqual(queued.call_args_list, [mock.call("posts.PostImages", pk) for pk in image_ids])
@@ -1,7 +1,10 @@
+from datetime import datetime, timezone as dt_timezone
+
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.decorators import action
 from rest_framework import viewsets, status, permissions, views, generics
-from django.db.models import Count, Exists, OuterRef
+from django.db.models import Exists, OuterRef
 
 from .permissions import IsOwnerOrReadOnly
 from .models import (
@@ -10,10 +13,14 @@ from .models import (
 )
 from .serializers import (
     PostSerializer, PostLikeSerializer,
-    PostCommentSerializer, PostViewSerializer
+    PostCommentSerializer, PostViewSerializer,
+    PostViewBatchSerializer
 )
+from .cache import get_first_page, set_first_page
+from .impressions import record_views
 
-from utils.pagination import StandardResultsSetPagination
+from utils.pagination import StandardResultsSetPagination, KeysetPagination, decode_cursor, encode_cursor
+from .feed import feed_page
 
 # Post ViewSet
 class PostViewSet(viewsets.ModelViewSet):
@@ -25,11 +32,8 @@ class PostViewSet(viewsets.ModelViewSet):
         return (
             Post.objects.all()
             .select_related('owner')
-            .prefetch_related('images')
+            .prefetch_related('images', 'images__variants')
             .annotate(
-                like_count=Count('post_likes', distinct=True),
-                comment_count=Count('post_comments', distinct=True),
-                view_count=Count('post_views', distinct=True),
                 is_liked=Exists(PostLikes.objects.filter(post=OuterRef('pk'), owner=self.request.user)),
                 is_read=Exists(PostViews.objects.filter(post=OuterRef('pk'), owner=self.request.user))
             )
@@ -47,6 +51,24 @@ class PostViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"])
+    def feed(self, request):
+        """Home feed: the user's timeline page of ids, hydrated in one query."""
+        limit = KeysetPagination().get_page_size(request)
+        before = request.query_params.get('before')
+        entries = feed_page(request.user.id, limit, decode_cursor(before, Post._meta.pk) if before else None)
+        has_next = len(entries) > limit
+        entries = entries[:limit]
+
+        posts = self.get_queryset().filter(is_active=True).in_bulk([pk for _, pk in entries])
+        serializer = self.get_serializer([posts[pk] for _, pk in entries if pk in posts], many=True)
+
+        next_link = None
+        if has_next:
+            score, pk = entries[-1]
+            cursor = encode_cursor(datetime.fromtimestamp(score, tz=dt_timezone.utc), pk)
+            next_link = replace_query_param(request.build_absolute_uri(), 'before', cursor)
+        return Response({'next': next_link, 'results': serializer.data})
 
 
 # Post like ViewSet
@@ -57,14 +79,36 @@ class PostLikeViewSet(viewsets.ModelViewSet):
     http_method_names = ['post', 'delete', 'head', 'options']
 
 
-# Post Likes Get API View
-class PostLikesGetAPIView(views.APIView):
+# Likers / commenters / viewers of a post, newest first
+class PostInteractionListAPIView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    model = None
+    kind = None
+
+    def get_queryset(self):
+        return self.model.objects.filter(post_id=str(self.kwargs['post_id'])).select_related('owner')
+
+    def list(self, request, *args, **kwargs):
+        post_id = str(kwargs['post_id'])
+        # Only the default first page is shared between clients
+        cacheable = not request.query_params
+        if cacheable:
+            cached = get_first_page(self.kind, post_id)
+            if cached is not None:
+                return Response(cached)
+
+        response = super().list(request, *args, **kwargs)
+        if cacheable:
+            set_first_page(self.kind, post_id, response.data)
+        return response
 
-    def get(self, request, post_id):
-        likes = PostLikes.objects.filter(post__id=post_id).select_related('owner', 'post')
-        serializer = PostLikeSerializer(likes, many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+# Post Likes Get API View
+class PostLikesGetAPIView(PostInteractionListAPIView):
+    serializer_class = PostLikeSerializer
+    model = PostLikes
+    kind = 'likes'
 
 
 # Post Comment ViewSet
@@ -75,13 +119,10 @@ class PostCommentViewSet(viewsets.ModelViewSet):
     http_method_names = ['post', 'patch', 'delete', 'head', 'options']
 
 
-class PostCommentGetAPIView(views.APIView):
-    permission_classes = [permissions.IsAuthenticated]
-
-    def get(self, request, post_id):
-        comments = PostComment.objects.filter(post__id=post_id).select_related('owner')
-        serializer = PostCommentSerializer(comments, many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+class PostCommentGetAPIView(PostInteractionListAPIView):
+    serializer_class = PostCommentSerializer
+    model = PostComment
+    kind = 'comments'
 
 
 # Post View CreateAPIView
@@ -91,10 +132,18 @@ class PostViewCreateAPIView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
 
-class PostViewGetAPIView(views.APIView):
+# Batched impressions: deduplicated in Redis and written by posts.tasks.flush_post_views
+class PostViewBatchAPIView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get(self, request, post_id):
-        views = PostViews.objects.filter(post__id=post_id).select_related('owner')
-        serializer = PostViewSerializer(views, many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def post(self, request):
+        serializer = PostViewBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recorded = record_views(request.user.id, serializer.validated_data['post_ids'])
+        return Response({'recorded': recorded}, status=status.HTTP_202_ACCEPTED)
+
+
+class PostViewGetAPIView(PostInteractionListAPIView):
+    serializer_class = PostViewSerializer
+    model = PostViews
+    kind = 'views'
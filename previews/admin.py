@@ -0,0 +1,9 @@
+from django.contrib import admin
+
+from .models import MediaVariant
+
+
+@admin.register(MediaVariant)
+class MediaVariantAdmin(admin.ModelAdmin):
+    list_display = ("content_type", "object_id", "kind", "format", "width", "height", "file_size", "created_at")
+    list_filter = ("kind", "format", "content_type")
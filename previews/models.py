@@ -0,0 +1,34 @@
+from django.db import models
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+
+
+# A resized rendition of an uploaded image, or of a video's poster frame.
+# Sources reach their variants through a GenericRelation named "variants".
+class MediaVariant(models.Model):
+    KINDS = [
+        ("thumb", "Thumbnail"),
+        ("preview", "Preview"),
+    ]
+    FORMATS = [
+        ("webp", "WebP"),
+        ("jpeg", "JPEG"),
+    ]
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=128)
+    source = GenericForeignKey("content_type", "object_id")
+    kind = models.CharField(max_length=20, choices=KINDS)
+    format = models.CharField(max_length=10, choices=FORMATS)
+    file = models.FileField(upload_to="previews/")
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    file_size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Also serves the per-source lookup on (content_type, object_id)
+        unique_together = ("content_type", "object_id", "kind", "format")
+
+    def __str__(self):
+        return f"{self.kind}.{self.format} of {self.content_type_id}:{self.object_id}"
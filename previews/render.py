@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import mimetypes
+import subprocess
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Longest side in pixels per variant kind; sources are never upscaled
+VARIANT_SIZES = {"preview": 720, "thumb": 160}
+VARIANT_QUALITY = {"webp": 80, "jpeg": 82}
+POSTER_TIMEOUT = 30
+
+
+def media_kind(name):
+    mime, _ = mimetypes.guess_type(name)
+    return (mime or "").split("/", 1)[0]
+
+
+def load_image(fp):
+    try:
+        image = Image.open(fp)
+        # JPEGs decode straight at a reduced scale when far larger than the biggest variant
+        largest = max(VARIANT_SIZES.values())
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return None
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    return image
+
+
+def extract_poster(path):
+    """First frame at ~1s of a video as an image, or None without ffmpeg."""
+    binary = shutil.which(settings.FFMPEG_BINARY)
+    if binary is None:
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        poster = os.path.join(tmp, "poster.jpg")
+        # Clips shorter than a second only have a frame at 0
+        for seek in ("1", "0"):
+            try:
+                subprocess.run(
+                    [binary, "-v", "error", "-y", "-ss", seek, "-i", path, "-frames:v", "1", poster],
+                    check=True, capture_output=True, timeout=POSTER_TIMEOUT,
+                )
+            except (subprocess.SubprocessError, OSError):
+                continue
+            if os.path.exists(poster) and os.path.getsize(poster):
+                with open(poster, "rb") as fp:
+                    return load_image(BytesIO(fp.read()))
+    return None
+
+
+def load_source(fieldfile):
+    kind = media_kind(fieldfile.name)
+    if kind == "image":
+        with fieldfile.open("rb") as fp:
+            return load_image(fp)
+    if kind == "video":
+        try:
+            path = fieldfile.path
+        except NotImplementedError:
+            return None
+        return extract_poster(path)
+    return None
+
+
+def _encode(image, fmt):
+    if fmt == "jpeg" and image.mode == "RGBA":
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, format=fmt.upper(), quality=VARIANT_QUALITY[fmt], optimize=fmt == "jpeg")
+    return buffer.getvalue()
+
+
+def render_variants(image):
+    """
+    Yields (kind, format, width, height, data) for every variant. Each size is
+    resized from the previous, larger one rather than from the original.
+    """
+    for kind, side in sorted(VARIANT_SIZES.items(), key=lambda item: -item[1]):
+        if max(image.size) > side:
+            image = image.resize(_fit(image.size, side), Image.Resampling.LANCZOS)
+        for fmt in VARIANT_QUALITY:
+            yield kind, fmt, image.width, image.height, _encode(image, fmt)
+
+
+def _fit(size, side):
+    width, height = size
+    scale = side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
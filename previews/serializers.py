@@ -0,0 +1,19 @@
+from rest_framework import serializers
+
+
+class MediaVariantsField(serializers.ReadOnlyField):
+    """
+    {kind: {"width", "height", format: url}} for a source's "variants"
+    relation, read from the prefetch cache when the queryset has one.
+    """
+
+    def to_representation(self, variants):
+        request = self.context.get("request")
+        result = {}
+        for variant in variants.all():
+            url = variant.file.url
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            entry = result.setdefault(variant.kind, {"width": variant.width, "height": variant.height})
+            entry[variant.format] = url
+        return result
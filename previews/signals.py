@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .models import MediaVariant
+from .tasks import PREVIEW_SOURCES, collected_variant_deletes, delete_variant_files, generate_variants
+
+
+def queue_variants(sender, instance, created, **kwargs):
+    if created:
+        label, object_id = sender._meta.label, str(instance.pk)
+        transaction.on_commit(lambda: generate_variants.delay(label, object_id))
+
+
+for label in PREVIEW_SOURCES:
+    post_save.connect(queue_variants, sender=label, dispatch_uid=f"previews_queue_variants_{label}")
+
+
+def delete_variant_file(sender, instance, **kwargs):
+    # Storage is touched after commit by a worker, never on the request path
+    if not instance.file:
+        return
+    name = instance.file.name
+    collected = collected_variant_deletes.get()
+    if collected is not None:
+        collected.append(name)
+    else:
+        transaction.on_commit(lambda: delete_variant_files.delay([name]))
+
+
+post_delete.connect(delete_variant_file, sender=MediaVariant)
@@ -0,0 +1,81 @@
+import logging
+from contextvars import ContextVar
+
+from celery import shared_task
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import IntegrityError
+
+from .models import MediaVariant
+from .render import load_source, render_variants, VARIANT_QUALITY, VARIANT_SIZES
+
+logger = logging.getLogger(__name__)
+
+# Models that get variants, and the file field each one renders from
+PREVIEW_SOURCES = {
+    "chat.File": "file",
+    "posts.PostImages": "image",
+    "stories.Story": "media",
+}
+VARIANT_EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+# While set, the MediaVariant post_delete signal appends storage names here
+# instead of queueing one cleanup task per row; batch deletes remove them together
+collected_variant_deletes = ContextVar("collected_variant_deletes", default=None)
+
+
+@shared_task
+def generate_variants(label, object_id):
+    """
+    Renders the missing variants of one source. Sources that are neither a
+    readable image nor a video with a decodable frame get none.
+    """
+    model = apps.get_model(label)
+    instance = model.objects.filter(pk=object_id).first()
+    if instance is None:
+        return 0
+    fieldfile = getattr(instance, PREVIEW_SOURCES[label])
+    if not fieldfile:
+        return 0
+
+    content_type = ContentType.objects.get_for_model(model)
+    object_id = str(instance.pk)
+    existing = set(
+        MediaVariant.objects.filter(content_type=content_type, object_id=object_id).values_list("kind", "format")
+    )
+    if len(existing) == len(VARIANT_SIZES) * len(VARIANT_QUALITY):
+        return 0
+
+    image = load_source(fieldfile)
+    if image is None:
+        return 0
+
+    created = 0
+    for kind, fmt, width, height, data in render_variants(image):
+        if (kind, fmt) in existing:
+            continue
+        variant = MediaVariant(
+            content_type=content_type, object_id=object_id, kind=kind, format=fmt,
+            width=width, height=height, file_size=len(data),
+        )
+        variant.file.save(
+            f"{model._meta.model_name}_{object_id}_{kind}.{VARIANT_EXTENSIONS[fmt]}", ContentFile(data), save=False
+        )
+        try:
+            variant.save()
+        except IntegrityError:
+            # A concurrent run got there first
+            variant.file.delete(save=False)
+            continue
+        created += 1
+    logger.info(f"Rendered {created} variants for {label} {object_id}")
+    return created
+
+
+@shared_task
+def delete_variant_files(names):
+    storage = MediaVariant._meta.get_field("file").storage
+    for name in names:
+        storage.delete(name)
+    return len(names)
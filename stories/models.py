@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.contenttypes.fields import GenericRelation
 
 from accounts.models import CustomUser
 
@@ -18,6 +19,7 @@ class Story(models.Model):
     audience = models.CharField(max_length=10, choices=select_action, default='public')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    variants = GenericRelation("previews.MediaVariant")
 
     class Meta:
         ordering = ["-created_at"]
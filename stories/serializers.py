@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from accounts.serializers import UserMiniSerializer
+from previews.serializers import MediaVariantsField
 from .models import Story, StoryViewed, StoryReaction
 
 
@@ -35,6 +36,7 @@ class StoryModelSerializer(serializers.ModelSerializer):
     owner = UserMiniSerializer(read_only=True)
     viewers = StoryViewedModelSerializer(read_only=True, many=True)
     reactions = StoryReactionModelSerializer(read_only=True, many=True)
+    variants = MediaVariantsField()
 
     class Meta:
         model = Story
@@ -25,7 +25,7 @@ class StoriesModelViewSet(ModelViewSet):
     parser_classes = (FormParser, MultiPartParser)
 
     def list(self, request, *args, **kwargs):
-        user_stories = self.queryset.filter(owner=request.user)
+        user_stories = self.queryset.filter(owner=request.user).prefetch_related('variants')
         serializer = self.serializer_class(user_stories, many=True, context={"request": request})
         return Response(data=serializer.data, status=200)
 
@@ -70,7 +70,7 @@ class UserStoriesAPIView(APIView):
             Story.objects
             .filter(visible_q)
             .select_related('owner')
-            .prefetch_related('marked', 'viewers', 'reactions')
+            .prefetch_related('marked', 'viewers', 'reactions', 'variants')
             .distinct()
         )
         serializer = self.serializer_class(stories_qs, many=True, context={'request': request})
@@ -85,7 +85,7 @@ class ArchiveStoriesListAPIView(APIView):
     parser_classes = (FormParser, MultiPartParser)
 
     def get(self, request, *args, **kwargs):
-        user_stories = Story.objects.filter(owner=request.user, is_active=False)
+        user_stories = Story.objects.filter(owner=request.user, is_active=False).prefetch_related('variants')
         serializer = self.serializer_class(user_stories, many=True, context={"request": request})
         return Response(serializer.data, status=200)
 
@@ -1,6 +1,117 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
+
+
+def encode_cursor(created_at, pk):
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor, pk_field=None):
+    """
+    (created_at, pk) from a cursor. With `pk_field` the pk is also converted
+    by that model field, so a tampered cursor is rejected here rather than by
+    the database.
+    """
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        created_at = datetime.fromisoformat(created_at)
+        if pk_field is not None:
+            pk = pk_field.to_python(pk)
+    except (ValueError, UnicodeDecodeError, DjangoValidationError):
+        raise NotFound("Invalid cursor")
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at, dt_timezone.utc)
+    return created_at, pk
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest-first cursor pagination on (created_at, pk). `before` pages back in
+    time and `after` pages forward; each page is a single indexed range scan
+    with no OFFSET and no COUNT.
+    """
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    before_query_param = 'before'
+    after_query_param = 'after'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+
+        if after:
+            created_at, pk = decode_cursor(after, queryset.model._meta.pk)
+            rows = list(
+                queryset
+                .filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+                .order_by('created_at', 'pk')[:size + 1]
+            )
+            self.has_previous = len(rows) > size
+            self.has_next = True
+            rows = rows[:size][::-1]
+        else:
+            if before:
+                created_at, pk = decode_cursor(before, queryset.model._meta.pk)
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+            rows = list(queryset.order_by('-created_at', '-pk')[:size + 1])
+            self.has_next = len(rows) > size
+            self.has_previous = bool(before)
+            rows = rows[:size]
+
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.page or not self.has_next:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.after_query_param)
+        last = self.page[-1]
+        return replace_query_param(url, self.before_query_param, encode_cursor(last.created_at, last.pk))
+
+    def get_previous_link(self):
+        if not self.page or not self.has_previous:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.before_query_param)
+        first = self.page[0]
+        return replace_query_param(url, self.after_query_param, encode_cursor(first.created_at, first.pk))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }